@@ -0,0 +1,166 @@
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from capture_file import CaptureFile
+from vitals import CHANNELS, HEART_BAND, SAMPLE_RATE, BeatDetector, FirFilter, VitalSignEngine, bandpass_taps
+
+ANALYSIS_WORKERS = 2
+CACHED_RESULTS = 256
+
+RHYTHM_WINDOW = 30
+RHYTHM_HOP = 10
+# Measurements shorter than RHYTHM_WINDOW are judged on what they have, from
+# this many seconds on.
+RHYTHM_MIN_WINDOW = 8
+RHYTHM_MIN_BEATS = 10
+AFIB_IRREGULARITY = 0.1
+
+AGGREGATE_WINDOW = 60
+
+# Forked workers start at once and share the parent's resource tracker.
+# Where fork is unavailable (Windows) they are spawned, which re-imports the
+# main module in each worker.
+START_METHOD = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def rhythm_analysis(samples, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    signal = samples[channels - 1::channels].astype(float)
+    detector = BeatDetector(sample_rate, beats=None)
+    detector.process(FirFilter(bandpass_taps(*HEART_BAND, sample_rate)).process(signal))
+    intervals = np.asarray(detector.intervals, dtype=float)
+    if len(intervals) < RHYTHM_MIN_BEATS:
+        return {"rhythm": None, "beats": len(intervals)}
+    mean = intervals.mean()
+    variation = float(intervals.std() / mean)
+    rmssd = float(np.sqrt(np.mean(np.diff(intervals) ** 2)) / mean)
+    irregular = variation > AFIB_IRREGULARITY and rmssd > AFIB_IRREGULARITY
+    return {
+        "rhythm": "AFIB" if irregular else "Normal",
+        "beats": len(intervals),
+        "variation": variation,
+        "rmssd": rmssd
+    }
+
+
+def window_aggregates(path, window=AGGREGATE_WINDOW):
+    recording = CaptureFile(path)
+    engine = VitalSignEngine(recording.sample_rate, recording.channels)
+    engine.beats = BeatDetector(recording.sample_rate, beats=None)
+    chunk = window * recording.sample_rate * recording.channels
+    rows = []
+    for start in range(0, recording.count, chunk):
+        first, samples = recording.read(start, start + chunk)
+        engine.process(samples)
+        rates = 60 * recording.sample_rate / np.asarray(engine.beats.intervals, dtype=float)
+        engine.beats.intervals.clear()
+        vital_signs = engine.latest()
+        rows.append((recording.time_of(first) or recording.started.timestamp() + start / chunk * window,
+                     float(rates.mean()) if len(rates) else None,
+                     float(rates.min()) if len(rates) else None,
+                     float(rates.max()) if len(rates) else None,
+                     vital_signs["spo2"],
+                     vital_signs["respiration_rate"]))
+    return rows
+
+
+ANALYSES = {
+    "rhythm": rhythm_analysis
+}
+
+RECORDING_ANALYSES = {
+    "aggregates": window_aggregates
+}
+
+
+def run_shared(name, shm_name, size, dtype, kwargs):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        samples = np.ndarray(size, dtype=dtype, buffer=shm.buf)
+        result = ANALYSES[name](samples, **kwargs)
+        del samples
+        return result
+    finally:
+        shm.close()
+
+
+def run_recording(name, path, kwargs):
+    return RECORDING_ANALYSES[name](path, **kwargs)
+
+
+def release(shm):
+    shm.close()
+    shm.unlink()
+
+
+class AnalysisExecutor:
+    """Runs CPU-heavy capture analysis in a pool of worker processes.
+
+    Capture slices are handed over through ``multiprocessing.shared_memory``
+    so only a block name crosses the process boundary, and futures are cached
+    by (analysis, measurement id, start, stop) so every viewer of the same
+    window shares one computation. Analyses of a finished recording get only
+    its path and memory-map the file themselves. Workers are forked by
+    ``start``, which should run before the process starts any other thread,
+    or spawned where the platform cannot fork.
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS, cached_results=CACHED_RESULTS):
+        self.workers = workers
+        self.cached_results = cached_results
+        self.pool = None
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.pool is None:
+            if START_METHOD == "fork":
+                # Workers must share the parent's tracker, or they would "clean up"
+                # blocks the parent already unlinked when they exit.
+                resource_tracker.ensure_running()
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(START_METHOD))
+            # Submitting starts the workers; no need to wait for one to answer.
+            self.pool.submit(int)
+        return self
+
+    def submit(self, name, capture, start, stop, **kwargs):
+        key = (name, capture.measurement_id, start, stop)
+        with self.lock:
+            future = self.results.get(key)
+            if future is not None:
+                self.results.move_to_end(key)
+                return future
+
+        first, samples = capture.samples.read(start, stop)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, samples.nbytes))
+        view = np.ndarray(len(samples), dtype=samples.dtype, buffer=shm.buf)
+        view[:] = samples
+        del view
+
+        self.start()
+        future = self.pool.submit(run_shared, name, shm.name, len(samples), samples.dtype.str, kwargs)
+        future.add_done_callback(lambda done: self.finished(key, done, shm))
+        with self.lock:
+            self.results[key] = future
+            while len(self.results) > self.cached_results:
+                self.results.popitem(last=False)
+        return future
+
+    def submit_recording(self, name, path, **kwargs):
+        self.start()
+        return self.pool.submit(run_recording, name, path, kwargs)
+
+    def finished(self, key, future, shm):
+        release(shm)
+        if future.exception() is not None:
+            with self.lock:
+                self.results.pop(key, None)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
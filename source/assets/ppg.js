@@ -0,0 +1,122 @@
+// /samples hands out one page per request; keep asking until the capture is in.
+function loadReplaySamples(loaded, start) {
+    fetch('/samples/' + loaded.measurementId + '?start=' + start).then(function (response) {
+        const first = parseInt(response.headers.get('X-First-Sample') || '0', 10);
+        const count = parseInt(response.headers.get('X-Sample-Count') || '0', 10);
+        return response.arrayBuffer().then(function (buffer) {
+            if (!loaded.samples) {
+                loaded.first = first;
+                loaded.samples = new Uint16Array(Math.max(0, count - first));
+            }
+            const offset = first - loaded.first;
+            const page = new Uint16Array(buffer).subarray(0, Math.max(0, loaded.samples.length - offset));
+            loaded.samples.set(page, offset);
+            loaded.available = offset + page.length;
+            if (page.length && loaded.available < loaded.samples.length) {
+                loadReplaySamples(loaded, loaded.first + loaded.available);
+            }
+        });
+    });
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ppg: {
+        stream: function (handle, windowSeconds, nIntervals, state) {
+            const current = window.ppgStream;
+            const maxPoints = Math.max(1, Math.round((windowSeconds || 1) * state.rate));
+            if (current && handle && current.measurementId === handle.measurement_id) {
+                current.maxPoints = maxPoints;
+                // A stream the server turned away or closed: make_graphs polls instead.
+                if (current.failed && !state.polling) {
+                    return Object.assign({}, state, {polling: true});
+                }
+                return window.dash_clientside.no_update;
+            }
+            if (current) {
+                current.source.close();
+                window.ppgStream = null;
+            }
+            if (!handle) {
+                return window.dash_clientside.no_update;
+            }
+            const stream = {
+                source: new EventSource('/stream/' + handle.measurement_id),
+                measurementId: handle.measurement_id,
+                maxPoints: maxPoints
+            };
+            stream.source.onmessage = function (event) {
+                const graph = document.querySelector('#ppg-graph .js-plotly-plot');
+                // Leave a zoomed view alone; autoscale brings the live window back.
+                if (!graph || !window.Plotly || (graph.layout.xaxis && graph.layout.xaxis.autorange === false)) {
+                    return;
+                }
+                const batch = JSON.parse(event.data);
+                const x = batch.y.map(function (_, i) { return batch.start + i; });
+                Plotly.extendTraces(graph, {x: [x], y: [batch.y]}, [0], stream.maxPoints);
+            };
+            stream.source.onerror = function () {
+                stream.failed = stream.source.readyState === EventSource.CLOSED;
+            };
+            stream.source.addEventListener('end', function () {
+                stream.source.close();
+            });
+            window.ppgStream = stream;
+            return Object.assign({}, state, {measurement_id: handle.measurement_id, polling: false});
+        },
+
+        toggleReplay: function (nClicks, handle, replay) {
+            if (!handle) {
+                return window.dash_clientside.no_update;
+            }
+            if (replay.playing) {
+                return Object.assign({}, replay, {playing: false});
+            }
+            let loaded = window.ppgReplay;
+            if (!loaded || loaded.measurementId !== handle.measurement_id) {
+                loaded = window.ppgReplay = {measurementId: handle.measurement_id, samples: null, first: 0,
+                                             available: 0};
+                loadReplaySamples(loaded, 0);
+            }
+            loaded.clock = null;
+            const total = loaded.samples ? loaded.samples.length : Infinity;
+            const position = replay.position >= total ? 0 : replay.position;
+            return Object.assign({}, replay, {playing: true, position: position});
+        },
+
+        replayTick: function (nIntervals, speed, windowSeconds, replay, figure) {
+            const loaded = window.ppgReplay;
+            const noUpdate = window.dash_clientside.no_update;
+            if (!replay.playing || !loaded || !loaded.samples || !figure) {
+                return [noUpdate, noUpdate];
+            }
+            // Advance by wall-clock time, so late ticks and speed changes keep the pace.
+            const now = performance.now();
+            const clock = loaded.clock || {time: now, position: replay.position};
+            const total = loaded.samples.length;
+            // Play no further than the pages loaded so far.
+            const position = Math.min(loaded.available,
+                                      clock.position + (now - clock.time) / 1000 * (speed || 1) * replay.rate);
+            loaded.clock = {time: now, position: position};
+
+            const stop = Math.floor(position);
+            const start = Math.max(0, stop - Math.round((windowSeconds || 1) * replay.rate));
+            const x = new Array(stop - start);
+            for (let i = 0; i < x.length; i++) {
+                x[i] = loaded.first + start + i;
+            }
+            const trace = Object.assign({}, figure.data[0], {x: x, y: Array.from(loaded.samples.subarray(start, stop))});
+            const layout = Object.assign({}, figure.layout, {
+                xaxis: Object.assign({}, figure.layout.xaxis, {autorange: true}),
+                yaxis: Object.assign({}, figure.layout.yaxis, {autorange: true})
+            });
+            return [
+                Object.assign({}, figure, {data: [trace].concat(figure.data.slice(1)), layout: layout}),
+                Object.assign({}, replay, {playing: stop < total, position: stop})
+            ];
+        },
+
+        replayControls: function (replay) {
+            return [!replay.playing, replay.playing ? 'Pause' : 'Replay'];
+        }
+    }
+});
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import time
+
+POLL = 0.5
+
+workdir = tempfile.mkdtemp(prefix="bench-cards-")
+os.environ.setdefault("BLE_TRANSPORT", "simulated")
+os.environ.setdefault("RECORDINGS_DIR", os.path.join(workdir, "recordings"))
+os.environ.setdefault("PATIENT_DATABASE", os.path.join(workdir, "patients.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dashk  # noqa: E402
+from bench_load import DashSession, dependencies_by_output  # noqa: E402
+
+CARDS = ("heart-rate-value", "spo2-value", "respiration-rate-value", "rhythm-value")
+
+
+def main():
+    """Time until each metric card shows a value in the shortest measurement; fail if one never does."""
+    duration = min(seconds for seconds in dashk.MEASUREMENT_DURATIONS if seconds)
+    dependencies = dependencies_by_output(dashk.server.test_client().get("/_dash-dependencies").json)
+    address = dashk.connection_manager.transport.addresses[0]
+    dashk.patient_store.add_patient("bench-cards", address)
+    session = DashSession(dependencies, "bench-cards")
+    session.connect()
+    polls = 0
+    while not session.poll_connected(polls)[0]:
+        polls += 1
+        time.sleep(0.02)
+
+    _, response = session.call("stored-data.data", [1], ["bench-cards", duration])
+    session.handle = response["response"]["stored-data"]["data"]
+    future = dashk.acquisitions[address]["future"]
+    started = time.perf_counter()
+    shown = {}
+    ticks = 0
+    # Keep polling like the browser until the tick that sees the capture end.
+    while True:
+        finished = future.done()
+        ticks += 1
+        _, response = session.call("heart-rate-value.children", [ticks], [session.handle])
+        for card in CARDS:
+            value = ((response or {}).get("response", {}).get(card) or {}).get("children")
+            if card not in shown and value not in (None, "--"):
+                shown[card] = (time.perf_counter() - started, value)
+        if finished:
+            break
+        time.sleep(POLL)
+    dashk.run_coroutine(dashk.connection_manager.disconnect(address), timeout=10)
+    dashk.analysis_executor.shutdown()
+
+    print(f"metric cards during a {duration} s simulated measurement, polled every {POLL} s")
+    for card in CARDS:
+        if card in shown:
+            print(f"     {card:<24} {shown[card][1]!s:<16} after {shown[card][0]:5.1f} s")
+        else:
+            print(f"     {card:<24} never shown")
+    missing = [card for card in CARDS if card not in shown]
+    if missing:
+        sys.exit(f"no value shown for {', '.join(missing)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from buffers import SampleBuffer, decode_samples  # noqa: E402
+
+NOTIFICATION_RATE = 100
+PAYLOAD_SIZE = 244
+SECONDS = 10
+
+
+def hex_decode(data, storage):
+    hexadecimal_data = data.hex()
+    integers = [int(hexadecimal_data[i:i + 4], 16) for i in range(0, len(hexadecimal_data), 4)]
+    storage.extend(integers)
+
+
+def typed_decode(data, sample_buffer):
+    sample_buffer.extend(decode_samples(data))
+
+
+def main():
+    rng = np.random.default_rng(0)
+    notifications = [bytearray(rng.integers(0, 256, PAYLOAD_SIZE, dtype=np.uint8).tobytes())
+                     for _ in range(NOTIFICATION_RATE * SECONDS)]
+
+    expected = []
+    for data in notifications:
+        hex_decode(data, expected)
+    sample_buffer = SampleBuffer(capacity=len(expected))
+    for data in notifications:
+        typed_decode(data, sample_buffer)
+    assert np.array_equal(sample_buffer.read(0)[1], np.array(expected, dtype=np.uint16))
+
+    def run_hex():
+        storage = []
+        for data in notifications:
+            hex_decode(data, storage)
+
+    def run_typed():
+        buffer = SampleBuffer(capacity=len(expected))
+        for data in notifications:
+            typed_decode(data, buffer)
+
+    print(f"{len(notifications)} notifications of {PAYLOAD_SIZE} bytes "
+          f"({SECONDS} s at {NOTIFICATION_RATE} Hz)")
+    for name, func in (("hex string", run_hex), ("frombuffer", run_typed)):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        per_notification = best / len(notifications) * 1e6
+        load = best / SECONDS * 100
+        print(f"{name:>12}: {per_notification:8.2f} us/notification, {load:6.3f}% of one core per device")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+DEVICE_COUNTS = (1, 10, 100)
+RUN_SECONDS = 6
+GRAPH_POLLS = 5
+
+workdir = tempfile.mkdtemp(prefix="bench-load-")
+os.environ.setdefault("BLE_TRANSPORT", "simulated")
+os.environ.setdefault("SIMULATED_DEVICES", str(max(DEVICE_COUNTS)))
+os.environ.setdefault("RECORDINGS_DIR", os.path.join(workdir, "recordings"))
+os.environ.setdefault("PATIENT_DATABASE", os.path.join(workdir, "patients.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dashk  # noqa: E402
+from captures import CAPTURES_PER_SESSION  # noqa: E402
+
+
+class DashSession:
+    """One browser session driving the app's callbacks through the Flask test client."""
+
+    def __init__(self, dependencies, patient_id):
+        self.client = dashk.server.test_client()
+        self.dependencies = dependencies
+        self.patient_id = patient_id
+        self.handle = None
+
+    def call(self, output, inputs, state=(), changed=()):
+        dependency = self.dependencies[output]
+        outputs = [dict(zip(("id", "property"), o.rsplit(".", 1)))
+                   for o in dependency["output"].strip(".").split("...")]
+        body = {
+            "output": dependency["output"],
+            "outputs": outputs if len(outputs) > 1 else outputs[0],
+            "inputs": [dict(i, value=v) for i, v in zip(dependency["inputs"], inputs)],
+            "state": [dict(s, value=v) for s, v in zip(dependency["state"], state)],
+            "changedPropIds": list(changed)
+        }
+        started = time.perf_counter()
+        response = self.client.post("/_dash-update-component", json=body)
+        elapsed = time.perf_counter() - started
+        assert response.status_code in (200, 204), response.data[:200]
+        return elapsed, response.json if response.status_code == 200 else None
+
+    def connection_status(self, n_intervals, changed):
+        _, response = self.call("status-button.children", [1, None, n_intervals], [1000, None, self.patient_id],
+                                [changed])
+        return response["response"]
+
+    def connect(self):
+        self.call("status-button.children", [None, None, 0], [None, None, self.patient_id])
+        self.connection_status(0, "connect-button.n_clicks")
+
+    def poll_connected(self, n_intervals):
+        status = self.connection_status(n_intervals, "connection-interval.n_intervals")
+        return status["connection-interval"]["disabled"], status["status-button"]["children"]
+
+    def start(self, duration=0):
+        elapsed, response = self.call("stored-data.data", [1], [self.patient_id, duration])
+        self.handle = response["response"]["stored-data"]["data"]
+        return elapsed
+
+    def make_graphs(self):
+        return self.call("ppg-graph.figure", [1, None], [{"live": True}, self.handle, 5, None],
+                         ["graph-interval-component.n_intervals"])[0]
+
+    def vital_signs(self):
+        return self.call("heart-rate-value.children", [1], [self.handle])[0]
+
+    def stop(self):
+        self.call("measurement-status.children", [1])
+
+
+def dependencies_by_output(dependencies):
+    # Callbacks keyed by their first output; the ones whose first output is
+    # a duplicate are not driven from here.
+    keyed = {d["output"].strip(".").split("...")[0]: d for d in dependencies}
+    return {output: d for output, d in keyed.items() if "@" not in output}
+
+
+def resident_memory():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def describe(values):
+    return (f"p50 {statistics.median(values) * 1000:7.2f} ms  "
+            f"p95 {percentile(values, 0.95) * 1000:7.2f} ms")
+
+
+def run(devices, dependencies, report=True):
+    addresses = dashk.connection_manager.transport.addresses[:devices]
+    sessions = []
+    for index, address in enumerate(addresses):
+        patient_id = f"sim-{devices}-{index:03d}-{report:d}"
+        dashk.patient_store.add_patient(patient_id, address)
+        sessions.append(DashSession(dependencies, patient_id))
+
+    dashk.connection_manager.connect_durations.clear()
+    started = time.perf_counter()
+    for session in sessions:
+        session.connect()
+    waiting = set(sessions)
+    polls = 0
+    while waiting:
+        time.sleep(0.02)
+        polls += 1
+        for session in list(waiting):
+            done, status = session.poll_connected(polls)
+            if done:
+                assert status == "Connected", status
+                waiting.discard(session)
+    connect_wall = time.perf_counter() - started
+    connect_times = list(dashk.connection_manager.connect_durations)
+
+    memory_before = resident_memory()
+    cpu_before = time.process_time()
+    run_started = time.perf_counter()
+    start_latency = [session.start() for session in sessions]
+    graph_latency, vitals_latency = [], []
+    for _ in range(GRAPH_POLLS):
+        time.sleep(RUN_SECONDS / GRAPH_POLLS)
+        for session in sessions:
+            graph_latency.append(session.make_graphs())
+            vitals_latency.append(session.vital_signs())
+    wall = time.perf_counter() - run_started
+    cpu = time.process_time() - cpu_before
+    memory = resident_memory() - memory_before
+
+    # Acquisitions start one after another, so rate each over its own lifetime.
+    now = time.time()
+    captures = [dashk.acquisitions[address]["capture"] for address in addresses]
+    samples = sum(capture.samples.count for capture in captures)
+    # np.zeros rings only become resident as they are written, so resident
+    # memory alone undercounts what a session can grow to.
+    allocated = sum(capture.samples.samples.nbytes for capture in captures)
+    written = sum(min(capture.samples.count, capture.samples.capacity) * capture.samples.samples.itemsize
+                  for capture in captures)
+    acquiring = sum(now - capture.started.timestamp() for capture in captures)
+    expected = dashk.connection_manager.transport.wristbands[addresses[0]].sample_rate * dashk.CHANNELS
+    for session in sessions:
+        session.stop()
+    for address in addresses:
+        dashk.run_coroutine(dashk.connection_manager.disconnect(address), timeout=10)
+
+    if not report:
+        return
+    print(f"{devices:>4} devices")
+    print(f"     connect: {describe(connect_times)} per device, all connected after {connect_wall:.2f} s")
+    print(f"     start_data_collection: {describe(start_latency)}")
+    print(f"     make_graphs:           {describe(graph_latency)}")
+    print(f"     update_vital_signs:    {describe(vitals_latency)}")
+    print(f"     ingest: {samples / wall:,.0f} samples/s, {samples / acquiring:,.0f} of {expected} per device, "
+          f"process CPU {cpu / wall * 100:.0f}% of one core")
+    print(f"     memory: {memory / devices / 2 ** 20:.2f} MiB resident per session; ring buffers "
+          f"{allocated / devices / 2 ** 20:.2f} MiB allocated, {written / devices / 2 ** 20:.3f} MiB written per "
+          f"capture, up to {CAPTURES_PER_SESSION} captures per session")
+
+
+def main():
+    dependencies = dependencies_by_output(dashk.server.test_client().get("/_dash-dependencies").json)
+    print(f"simulated wristbands: {os.environ['SIMULATED_DEVICES']} available, "
+          f"{os.environ.get('SIMULATED_SAMPLE_RATE', 200)} Hz, {os.environ.get('SIMULATED_PAYLOAD_SIZE', 244)} byte "
+          f"payloads; callbacks timed in-process through the Flask test client")
+    run(1, dependencies, report=False)
+    for devices in DEVICE_COUNTS:
+        run(devices, dependencies)
+
+
+if __name__ == '__main__':
+    main()
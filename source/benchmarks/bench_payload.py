@@ -0,0 +1,82 @@
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+MEASUREMENTS = 5
+
+workdir = tempfile.mkdtemp(prefix="bench-payload-")
+os.environ.setdefault("BLE_TRANSPORT", "simulated")
+os.environ.setdefault("RECORDINGS_DIR", os.path.join(workdir, "recordings"))
+os.environ.setdefault("PATIENT_DATABASE", os.path.join(workdir, "patients.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dash import dcc, html  # noqa: E402
+from plotly.io.json import to_json_plotly  # noqa: E402
+
+import dashk  # noqa: E402
+from bench_load import DashSession, dependencies_by_output  # noqa: E402
+
+
+def rerendered_start(handle):
+    """The response Start used to send: the whole panel again, around the new capture handle."""
+    panel = html.Div([dcc.Store(id='stored-data', data=handle), dashk.METRIC_CARDS, dashk.PLOT_PANEL] +
+                     dashk.PLOT_STATE)
+    return to_json_plotly({"multi": True, "response": {"measurement-output": {"children": panel}}}).encode()
+
+
+def rerendered_submit(patient_id):
+    controls = dashk.MEASUREMENT_CONTROLS[:-2] + [html.Div(id="measurement-output")]
+    children = html.Div(controls + [html.Div(dashk.patient_history(patient_id), id="patient-history")])
+    return to_json_plotly({"multi": True, "response": {"output-div-measurement": {"children": children}}}).encode()
+
+
+def describe(name, body):
+    return f"     {name:<34} {len(body):>7,} bytes  {len(gzip.compress(body)):>6,} gzipped"
+
+
+def main():
+    dependencies = dependencies_by_output(dashk.server.test_client().get("/_dash-dependencies").json)
+    address = dashk.connection_manager.transport.addresses[0]
+    dashk.patient_store.add_patient("bench-payload", address)
+    session = DashSession(dependencies, "bench-payload")
+    session.connect()
+    polls = 0
+    while not session.poll_connected(polls)[0]:
+        polls += 1
+        time.sleep(0.02)
+
+    _, submit = session.call("output-div-measurement.children", [1], ["bench-payload"])
+    submit = json.dumps(submit, separators=(",", ":")).encode()
+    starts = []
+    for clicks in range(1, MEASUREMENTS + 1):
+        _, start = session.call("stored-data.data", [clicks], ["bench-payload", 0])
+        starts.append(json.dumps(start, separators=(",", ":")).encode())
+        session.stop()
+    handle = json.loads(starts[-1])["response"]["stored-data"]["data"]
+    old_start, old_submit = rerendered_start(handle), rerendered_submit("bench-payload")
+    # Let the last acquisition finish and hand its recording to the pool
+    # before the pool goes away.
+    dashk.acquisitions[address]["future"].result(timeout=10)
+    dashk.run_coroutine(dashk.connection_manager.disconnect(address), timeout=10)
+    dashk.analysis_executor.shutdown()
+
+    print(f"callback response bodies for one patient, {MEASUREMENTS} measurements, as sent by Dash "
+          f"(Dash does not compress responses unless configured to)")
+    print("re-rendered panel")
+    print(describe("submit_patient_id", old_submit))
+    print(describe("start_data_collection", old_start))
+    print("panel rendered once, values updated")
+    print(describe("submit_patient_id", submit))
+    print(describe("start_data_collection", starts[-1]))
+    old_total = len(old_submit) + MEASUREMENTS * len(old_start)
+    new_total = len(submit) + sum(len(start) for start in starts)
+    print(f"per patient: {old_total:,} bytes before, {new_total:,} bytes after "
+          f"({new_total / old_total * 100:.0f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 5
+TOP_IMPORTS = 10
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    "standalone": {"BLE_TRANSPORT": "simulated"},
+    "gateway worker": {"BLE_GATEWAY_SOCKET": "ble-gateway.sock"},
+}
+
+# Stop the analysis workers before exiting, they hold the output pipes open.
+IMPORT = "import os, dashk; dashk.analysis_executor.shutdown(); os._exit(0)"
+FIRST_RESPONSE = """
+import os
+import dashk
+client = dashk.server.test_client()
+for path in ("/", "/_dash-layout", "/_dash-dependencies"):
+    assert client.get(path).status_code == 200, path
+print("ready", flush=True)
+dashk.analysis_executor.shutdown()
+os._exit(0)
+"""
+
+
+def environment(extra):
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = dict(os.environ, RECORDINGS_DIR=os.path.join(workdir, "recordings"),
+               PATIENT_DATABASE=os.path.join(workdir, "patients.db"), **extra)
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def import_times(env):
+    """(self, cumulative) microseconds and nesting depth per module from ``python -X importtime``."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT], cwd=SOURCE_DIR, env=env,
+                            capture_output=True, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        own, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times[name.strip()] = (int(own.split(":")[1]), int(cumulative), depth)
+    return times
+
+
+def first_response(env):
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", FIRST_RESPONSE], cwd=SOURCE_DIR, env=env,
+                               stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        if line.strip() == "ready":
+            break
+    else:
+        raise RuntimeError("app exited before answering")
+    elapsed = time.perf_counter() - started
+    process.wait()
+    return elapsed
+
+
+def run(mode, extra):
+    env = environment(extra)
+    runs = [import_times(env) for _ in range(RUNS)]
+    dashk_import = statistics.median(times["dashk"][1] for times in runs) / 1e6
+    dashk_body = statistics.median(times["dashk"][0] for times in runs) / 1e6
+    # dashk's direct imports, by median cumulative time.
+    names = {name for name, (_, _, depth) in runs[0].items() if depth == 1}
+    imports = sorted(((statistics.median(times.get(name, (0, 0, 0))[1] for times in runs) / 1e6, name)
+                      for name in names), reverse=True)
+    responses = [first_response(env) for _ in range(RUNS)]
+
+    print(f"{mode}")
+    print(f"     import dashk: {dashk_import * 1000:7.1f} ms median of {RUNS}, "
+          f"{dashk_body * 1000:.1f} ms of it in dashk's own module body")
+    for seconds, name in imports[:TOP_IMPORTS]:
+        print(f"         {name:<32} {seconds * 1000:7.1f} ms")
+    print(f"     process start to first response: {statistics.median(responses) * 1000:7.1f} ms median, "
+          f"{max(responses) * 1000:7.1f} ms max")
+    return statistics.median(responses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time dashk's imports and its first responses in a fresh process.")
+    parser.add_argument("--budget", type=float, help="fail when the median time to first response, in seconds, "
+                        "exceeds this")
+    args = parser.parse_args()
+    print(f"python {sys.version.split()[0]}; first response is GET /, /_dash-layout and /_dash-dependencies "
+          f"through the Flask test client")
+    slowest = max(run(mode, extra) for mode, extra in MODES.items())
+    if args.budget is not None and slowest > args.budget:
+        sys.exit(f"time to first response {slowest:.3f} s exceeds the {args.budget:.3f} s budget")
+
+
+if __name__ == '__main__':
+    main()
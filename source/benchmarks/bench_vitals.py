@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from buffers import SampleBuffer  # noqa: E402
+from vitals import SAMPLE_RATE, VitalSignEngine  # noqa: E402
+
+SECONDS = 60
+TICK = 1.0
+STREAM_COUNTS = (1, 10, 100)
+
+
+def synthetic_ppg(seed, seconds=SECONDS, sample_rate=SAMPLE_RATE):
+    rng = np.random.default_rng(seed)
+    t = np.arange(0, seconds, 1 / sample_rate)
+    heart_rate = rng.uniform(50, 120) / 60
+    respiration_rate = rng.uniform(10, 20) / 60
+    signal = (30000 + 800 * np.sin(2 * np.pi * respiration_rate * t)
+              + 1500 * np.maximum(0, np.sin(2 * np.pi * heart_rate * t)) ** 3
+              + rng.normal(0, 50, len(t)))
+    return signal.astype(np.uint16), heart_rate * 60
+
+
+def run(streams):
+    signals = [synthetic_ppg(seed) for seed in range(streams)]
+    buffers = [SampleBuffer(capacity=len(signal)) for signal, _ in signals]
+    engines = [VitalSignEngine() for _ in range(streams)]
+    chunk = int(TICK * SAMPLE_RATE)
+
+    elapsed = 0.0
+    for start in range(0, SECONDS * SAMPLE_RATE, chunk):
+        for (signal, _), sample_buffer in zip(signals, buffers):
+            sample_buffer.extend(signal[start:start + chunk])
+        started = time.perf_counter()
+        for engine, sample_buffer in zip(engines, buffers):
+            engine.update(sample_buffer)
+        elapsed += time.perf_counter() - started
+
+    errors = [abs(engine.latest()["heart_rate"] - expected)
+              for engine, (_, expected) in zip(engines, signals)]
+    return elapsed, max(errors)
+
+
+def main():
+    print(f"{SECONDS} s of {SAMPLE_RATE} Hz PPG per stream, updated every {TICK:.0f} s")
+    for streams in STREAM_COUNTS:
+        elapsed, error = run(streams)
+        load = elapsed / SECONDS
+        print(f"{streams:>4} streams: {elapsed * 1000:8.1f} ms total, {load * 100:6.2f}% of one core, "
+              f"~{streams / load:,.0f} streams/core, max HR error {error:.1f} BPM")
+
+
+if __name__ == '__main__':
+    main()
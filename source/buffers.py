@@ -0,0 +1,98 @@
+import threading
+
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype('>u2')
+
+
+def decode_samples(data):
+    """Decode a notification payload of big-endian uint16 samples without copying.
+
+    A trailing odd byte cannot form a sample and is left out; callers can
+    compare ``len(data)`` against ``2 * len(result)`` to account for it.
+    """
+    return np.frombuffer(data, dtype=SAMPLE_DTYPE, count=len(data) // 2)
+
+
+class SampleBuffer:
+    """Fixed-size ring buffer of samples addressed by absolute sample index.
+
+    The BLE loop thread appends notifications while Dash callbacks read
+    slices from worker threads, so every access goes through ``lock``.
+    Once more than ``capacity`` samples have been written the oldest ones
+    are overwritten and ``first_index`` moves forward.
+    """
+
+    def __init__(self, capacity=2 ** 16, dtype=np.uint16):
+        self.capacity = capacity
+        self.samples = np.zeros(capacity, dtype=dtype)
+        self.count = 0
+        self.truncated_bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def first_index(self):
+        return max(0, self.count - self.capacity)
+
+    def extend(self, values):
+        values = np.asarray(values)
+        size = len(values)
+        if size == 0:
+            return
+        with self.lock:
+            if size > self.capacity:
+                self.count += size - self.capacity
+                values = values[-self.capacity:]
+                size = self.capacity
+            start = self.count % self.capacity
+            end = start + size
+            if end <= self.capacity:
+                self.samples[start:end] = values
+            else:
+                split = self.capacity - start
+                self.samples[start:] = values[:split]
+                self.samples[:end - self.capacity] = values[split:]
+            self.count += size
+
+    def read(self, start, stop=None):
+        with self.lock:
+            stop = self.count if stop is None else min(stop, self.count)
+            start = max(start, self.first_index)
+            if start >= stop:
+                return stop, np.empty(0, dtype=self.samples.dtype)
+            i = start % self.capacity
+            j = i + (stop - start)
+            if j <= self.capacity:
+                return start, self.samples[i:j].copy()
+            return start, np.concatenate((self.samples[i:], self.samples[:j - self.capacity]))
+
+    def read_since(self, cursor, limit=None):
+        stop = None if limit is None else cursor + limit
+        start, samples = self.read(cursor, stop)
+        return samples, start + len(samples)
+
+
+class Subscription:
+    """One reader's cursor into a shared SampleBuffer.
+
+    Readers never hold the producer back. A subscriber that falls more than
+    ``max_lag`` samples behind, or whose next samples were already
+    overwritten, skips ahead to the newest data, and the skipped samples
+    are counted in ``dropped``.
+    """
+
+    def __init__(self, sample_buffer, cursor=0, max_lag=None):
+        self.sample_buffer = sample_buffer
+        self.cursor = cursor
+        self.max_lag = max_lag
+        self.dropped = 0
+
+    def read(self, limit=None):
+        start = self.cursor
+        if self.max_lag is not None:
+            start = max(start, self.sample_buffer.count - self.max_lag)
+        first, samples = self.sample_buffer.read(start, None if limit is None else start + limit)
+        if len(samples):
+            self.dropped += first - self.cursor
+            self.cursor = first + len(samples)
+        return first, samples
@@ -0,0 +1,177 @@
+import os
+import re
+import struct
+import time
+from datetime import datetime
+
+import numpy as np
+
+from vitals import CHANNELS, SAMPLE_RATE
+
+RECORDINGS_DIR = os.environ.get("RECORDINGS_DIR", "recordings")
+RECORDING_SUFFIX = ".ppg"
+INDEX_SUFFIX = ".idx"
+TIME_FORMAT = "%Y%m%dT%H%M%S"
+FLUSH_INTERVAL = 0.05
+# Chunks arriving this much later than their predecessor's samples account
+# for mark a gap in the signal, e.g. while a dropped link was restored.
+GAP_THRESHOLD = 0.5
+
+# Recording layout: a fixed 64-byte header followed by every sample as raw
+# little-endian uint16, so the body can be memory-mapped as one flat array.
+# The header's state byte stays RECORDING until the writer closes the file.
+# The sidecar index gets one (first sample, wall-clock time) record per
+# appended chunk.
+MAGIC = b"PPGCAP01"
+HEADER = struct.Struct("<8sIHBxd32s8x")
+HEADER_SIZE = HEADER.size
+STATE_OFFSET = 14
+COMPLETE = 0
+RECORDING = 1
+SAMPLE_DTYPE = np.dtype("<u2")
+INDEX_RECORD = struct.Struct("<Qd")
+INDEX_DTYPE = np.dtype([("first_sample", "<u8"), ("time", "<f8")])
+
+
+def patient_directory(patient_id, root=None):
+    return os.path.join(root or RECORDINGS_DIR, re.sub(r"[^\w.-]", "_", str(patient_id)))
+
+
+def recording_path(patient_id, started, measurement_id, root=None):
+    name = f"{started.strftime(TIME_FORMAT)}_{measurement_id}{RECORDING_SUFFIX}"
+    return os.path.join(patient_directory(patient_id, root), name)
+
+
+def index_path(path):
+    return path[:-len(RECORDING_SUFFIX)] + INDEX_SUFFIX
+
+
+class CaptureWriter:
+    def __init__(self, path, measurement_id, started, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.count = 0
+        self.samples_file = open(path, "xb")
+        self.samples_file.write(HEADER.pack(MAGIC, sample_rate, channels, RECORDING, started.timestamp(),
+                                            measurement_id.encode()[:32]))
+        self.index_file = open(index_path(path), "xb")
+        self.flush()
+
+    def append(self, samples, timestamp=None):
+        if len(samples) == 0:
+            return
+        self.index_file.write(INDEX_RECORD.pack(self.count, timestamp or time.time()))
+        self.samples_file.write(np.asarray(samples, dtype=SAMPLE_DTYPE).tobytes())
+        self.count += len(samples)
+        if time.monotonic() - self.flushed >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self.samples_file.flush()
+        self.index_file.flush()
+        self.flushed = time.monotonic()
+
+    def close(self):
+        self.flush()
+        os.pwrite(self.samples_file.fileno(), bytes([COMPLETE]), STATE_OFFSET)
+        self.samples_file.close()
+        self.index_file.close()
+
+
+class CaptureFile:
+    """Read-only, memory-mapped view of a recording.
+
+    It offers the same ``count``/``first_index``/``read``/``read_since``
+    interface as SampleBuffer, so downsampling and vital-sign code can run
+    over a recording of any length, including one still being written.
+    """
+
+    first_index = 0
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or not header.startswith(MAGIC):
+            raise ValueError(f"{path} is not a capture recording")
+        magic, sample_rate, channels, state, started, measurement_id = HEADER.unpack(header)
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.started = datetime.fromtimestamp(started)
+        self.measurement_id = measurement_id.rstrip(b"\0").decode()
+        self.mapped = np.empty(0, dtype=SAMPLE_DTYPE)
+
+    @property
+    def in_progress(self):
+        with open(self.path, "rb") as f:
+            return os.pread(f.fileno(), 1, STATE_OFFSET) == bytes([RECORDING])
+
+    @property
+    def count(self):
+        return (os.path.getsize(self.path) - HEADER_SIZE) // SAMPLE_DTYPE.itemsize
+
+    def samples(self):
+        count = self.count
+        if count != len(self.mapped):
+            self.mapped = np.memmap(self.path, dtype=SAMPLE_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+        return self.mapped
+
+    def read(self, start, stop=None):
+        samples = self.samples()
+        stop = len(samples) if stop is None else min(stop, len(samples))
+        start = max(0, start)
+        if start >= stop:
+            return stop, np.empty(0, dtype=np.uint16)
+        return start, samples[start:stop].astype(np.uint16)
+
+    def read_since(self, cursor, limit=None):
+        stop = None if limit is None else cursor + limit
+        start, samples = self.read(cursor, stop)
+        return samples, start + len(samples)
+
+    def index(self):
+        path = index_path(self.path)
+        records = os.path.getsize(path) // INDEX_DTYPE.itemsize
+        if records == 0:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        return np.memmap(path, dtype=INDEX_DTYPE, mode="r", shape=(records,))
+
+    def gaps(self, threshold=GAP_THRESHOLD):
+        index = self.index()
+        if len(index) < 2:
+            return []
+        first_sample = index["first_sample"].astype(np.int64)
+        expected = index["time"][:-1] + np.diff(first_sample) / (self.sample_rate * self.channels)
+        late = index["time"][1:] - expected
+        return [(int(first_sample[i + 1]), float(late[i])) for i in np.flatnonzero(late > threshold)]
+
+    def times(self, start, stop):
+        """Wall-clock time of every sample in ``[start, stop)``."""
+        samples = np.arange(start, stop)
+        index = self.index()
+        if len(index) == 0:
+            return self.started.timestamp() + samples / (self.sample_rate * self.channels)
+        chunk = np.maximum(0, np.searchsorted(index["first_sample"], samples, side="right") - 1)
+        return index["time"][chunk] + (samples - index["first_sample"][chunk]) / (self.sample_rate * self.channels)
+
+    def sample_at(self, timestamp):
+        """Index of the first sample recorded at or after ``timestamp``."""
+        count = self.count
+        index = self.index()
+        chunk = int(np.searchsorted(index["time"], timestamp, side="right")) - 1
+        if chunk < 0:
+            return 0
+        sample = int(index["first_sample"][chunk]) + int(np.ceil((timestamp - index["time"][chunk]) *
+                                                                  self.sample_rate * self.channels))
+        # A time inside a gap belongs to the first chunk after it.
+        if chunk + 1 < len(index):
+            sample = min(sample, int(index["first_sample"][chunk + 1]))
+        return min(sample, count)
+
+    def time_of(self, sample_index):
+        index = self.index()
+        if len(index) == 0:
+            return None
+        chunk = max(0, np.searchsorted(index["first_sample"], sample_index, side="right") - 1)
+        offset = sample_index - int(index["first_sample"][chunk])
+        return float(index["time"][chunk]) + offset / (self.sample_rate * self.channels)
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from buffers import SampleBuffer
+from capture_file import CaptureFile, CaptureWriter, recording_path
+from downsample import DISPLAY_POINTS, MinMaxPyramid
+from vitals import VitalSignEngine
+
+CAPTURE_CAPACITY = 2 ** 20
+CAPTURES_PER_SESSION = 4
+# Across all sessions: at most this many captures, none left unread for
+# longer than CAPTURE_TTL seconds. A recorded one is reopened from its file
+# when asked for again.
+MAX_CAPTURES = 64
+CAPTURE_TTL = 30 * 60
+RECORD_CAPTURES = True
+RECORDING_POLL = 0.02
+
+
+class Capture:
+    def __init__(self, session_id, patient_id=None, capacity=CAPTURE_CAPACITY, recording=None):
+        self.session_id = session_id
+        self.patient_id = patient_id
+        self.writer = None
+        self.path = None
+        self.recording = recording
+        if recording is None:
+            self.measurement_id = uuid.uuid4().hex
+            self.started = datetime.now()
+            self.samples = SampleBuffer(capacity)
+        else:
+            self.measurement_id = recording.measurement_id
+            self.started = recording.started
+            self.samples = recording
+            self.path = recording.path
+        self.pyramid = MinMaxPyramid()
+        self.vitals = VitalSignEngine(recording.sample_rate, recording.channels) if recording else VitalSignEngine()
+        self.updated = threading.Condition()
+        self.ended = False
+        self.interruptions = []
+
+    def record(self):
+        self.path = recording_path(self.patient_id, self.started, self.measurement_id)
+        self.writer = CaptureWriter(self.path, self.measurement_id, self.started)
+
+    def extend(self, values):
+        self.samples.extend(values)
+        if self.writer is not None:
+            self.writer.append(values)
+        if self.samples.count - self.pyramid.cursor >= self.samples.capacity // 2:
+            self.pyramid.update(self.samples)
+        with self.updated:
+            self.updated.notify_all()
+
+    def mark_gap(self, seconds):
+        self.interruptions.append((self.samples.count, seconds))
+
+    def gaps(self):
+        """(first sample after the gap, seconds missing) for every interruption."""
+        if self.recording is not None:
+            return self.recording.gaps()
+        return list(self.interruptions)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        with self.updated:
+            self.ended = True
+            self.updated.notify_all()
+
+    @property
+    def closed(self):
+        if self.recording is not None:
+            return not self.recording.in_progress
+        return self.ended
+
+    def wait(self, cursor, timeout=None):
+        if self.recording is None:
+            with self.updated:
+                return self.updated.wait_for(lambda: self.closed or self.samples.count > cursor, timeout)
+        # Another process writes this recording, so watch the file instead.
+        deadline = time.monotonic() + (timeout if timeout is not None else float("inf"))
+        while not (self.samples.count > cursor or self.closed):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(RECORDING_POLL)
+        return True
+
+    def vital_signs(self):
+        return self.vitals.update(self.samples)
+
+    def window(self, start=0, stop=None, points=DISPLAY_POINTS):
+        return self.pyramid.window(self.samples, start, stop, points)
+
+    @property
+    def handle(self):
+        return {"measurement_id": self.measurement_id, "patient_id": self.patient_id}
+
+
+class CaptureStore:
+    """Server-side captures keyed by (session id, measurement id).
+
+    The browser only keeps ``Capture.handle``; callbacks resolve it back to
+    the typed sample buffer here and read the slices they need. Each
+    session keeps its ``per_session`` most recently used captures and the
+    store as a whole ``max_captures``, dropping any unused for ``ttl``
+    seconds. A handle this
+    process has not seen, e.g. one created by another web worker, is
+    reopened from the recording that ``locate`` returns for it.
+    """
+
+    def __init__(self, per_session=CAPTURES_PER_SESSION, locate=None, max_captures=MAX_CAPTURES, ttl=CAPTURE_TTL):
+        self.per_session = per_session
+        self.locate = locate
+        self.max_captures = max_captures
+        self.ttl = ttl
+        self.captures = OrderedDict()
+        self.last_used = {}
+        self.lock = threading.Lock()
+
+    def create(self, session_id, patient_id=None, record=RECORD_CAPTURES):
+        capture = Capture(session_id, patient_id)
+        if record and patient_id:
+            capture.record()
+        return self.add(capture)
+
+    def open_recording(self, session_id, path, patient_id=None):
+        return self.add(Capture(session_id, patient_id, recording=CaptureFile(path)))
+
+    def add(self, capture, session_id=None):
+        session_id = session_id or capture.session_id
+        key = (session_id, capture.measurement_id)
+        with self.lock:
+            self.captures[key] = capture
+            self.touch(key)
+            owned = [key for key in self.captures if key[0] == session_id]
+            for key in owned[:-self.per_session]:
+                self.drop(key)
+            self.evict()
+        return capture
+
+    def touch(self, key):
+        self.captures.move_to_end(key)
+        self.last_used[key] = time.monotonic()
+
+    def drop(self, key):
+        del self.captures[key]
+        del self.last_used[key]
+
+    def evict(self):
+        # Least recently used first. A ring buffer still being filled stays:
+        # its acquisition holds on to it anyway.
+        now = time.monotonic()
+        for key, capture in list(self.captures.items()):
+            if len(self.captures) <= self.max_captures and now - self.last_used[key] < self.ttl:
+                break
+            if capture.recording is None and not capture.ended:
+                continue
+            self.drop(key)
+
+    def get(self, session_id, handle):
+        if not handle:
+            return None
+        key = (session_id, handle.get("measurement_id"))
+        with self.lock:
+            capture = self.captures.get(key)
+            if capture is not None:
+                self.touch(key)
+            self.evict()
+        if capture is None and self.locate is not None:
+            path = self.locate(handle.get("measurement_id"))
+            if path and os.path.exists(path):
+                capture = self.open_recording(session_id, path, handle.get("patient_id"))
+        return capture
@@ -0,0 +1,302 @@
+import asyncio
+import functools
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+SCAN_TIMEOUT = 5.0
+CONNECT_TIMEOUT = 20
+DISCONNECT_TIMEOUT = 10
+MAX_CONCURRENT_CONNECTS = 4
+DISCOVERY_TTL = 30
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX_DELAY = 2.0
+RECONNECT_ATTEMPT_TIMEOUT = 5.0
+RECONNECT_TIMEOUT = 30
+
+SCAN_SECONDS = REGISTRY.histogram("ble_scan_seconds", "Duration of BLE device lookups.",
+                                  ["kind"])
+CONNECT_SECONDS = REGISTRY.histogram("ble_connect_seconds", "Time from connect request to an established link.")
+CONNECT_FAILURES = REGISTRY.counter("ble_connect_failures_total", "Connects that found no device or raised.")
+NOTIFICATIONS = REGISTRY.counter("ble_notifications_total", "GATT notifications received.", ["device"])
+NOTIFICATION_BYTES = REGISTRY.counter("ble_notification_bytes_total", "GATT notification payload bytes.",
+                                      ["device"])
+DROPPED_NOTIFICATIONS = REGISTRY.counter("ble_notifications_dropped_total",
+                                         "Notifications that arrived with no acquisition subscribed.", ["device"])
+DISCONNECTS = REGISTRY.counter("ble_disconnects_total", "Links dropped without a disconnect request.", ["device"])
+RECONNECT_SECONDS = REGISTRY.histogram("ble_reconnect_seconds", "Time from a dropped link to a restored one.")
+RECONNECT_FAILURES = REGISTRY.counter("ble_reconnect_failures_total",
+                                      "Dropped links given up after the reconnect timeout.")
+SCANNER_FAILURES = REGISTRY.counter("ble_scanner_failures_total",
+                                    "Background scanner starts that failed; lookups then scan per address.")
+
+
+class BleakTransport:
+    """The radio: scanning and GATT clients from bleak.
+
+    ConnectionManager only talks to the BLE stack through this interface,
+    so another transport such as ``simulator.SimulatedTransport`` can stand
+    in for the hardware. bleak and its D-Bus stack are imported on first
+    use, so web workers behind a gateway never load them.
+    """
+
+    def scanner(self, detection_callback):
+        from bleak import BleakScanner
+        return BleakScanner(detection_callback=detection_callback)
+
+    async def find_device(self, address, timeout):
+        from bleak import BleakScanner
+        return await BleakScanner.find_device_by_address(address, timeout=timeout)
+
+    def client(self, device, disconnected_callback=None):
+        from bleak import BleakClient
+        return BleakClient(device, disconnected_callback=disconnected_callback)
+
+
+class DeviceConnection:
+    """One device link. ``client`` is replaced when the link is restored
+    after a drop, so callers keep the connection rather than the client.
+
+    ``resume``, when set, is awaited on every restored link to bring the
+    device back to the state its user left it in; ``lost`` is set once
+    the link is gone for good.
+    """
+
+    def __init__(self, address, client, device=None):
+        self.address = address
+        self.client = client
+        self.device = device
+        self.connect_seconds = None
+        self.command_timings = []
+        self.characteristic = None
+        self.notifying = False
+        self.notification_handler = None
+        self.resume = None
+        self.disconnected_at = None
+        self.reconnect_task = None
+        self.lost = asyncio.Event()
+        self.notifications = NOTIFICATIONS.labels(address)
+        self.notification_bytes = NOTIFICATION_BYTES.labels(address)
+        self.dropped_notifications = DROPPED_NOTIFICATIONS.labels(address)
+
+    @property
+    def is_connected(self):
+        return self.client is not None and self.client.is_connected
+
+    async def resolve_characteristic(self, service_uuid, characteristic_uuid):
+        if self.characteristic is None:
+            for service in await self.client.get_services():
+                if service.uuid == service_uuid:
+                    for characteristic in service.characteristics:
+                        if characteristic.uuid == characteristic_uuid:
+                            self.characteristic = characteristic
+        return self.characteristic
+
+    async def subscribe(self, handler):
+        self.notification_handler = handler
+        if not self.notifying:
+            await self.client.start_notify(self.characteristic, self.dispatch)
+            self.notifying = True
+
+    async def restore(self):
+        # Handles and subscriptions belong to the old client.
+        self.characteristic = None
+        self.notifying = False
+        if self.resume is not None:
+            await self.resume()
+
+    def unsubscribe(self, handler):
+        if self.notification_handler is handler:
+            self.notification_handler = None
+
+    def dispatch(self, sender, data):
+        self.notifications.inc()
+        self.notification_bytes.inc(len(data))
+        handler = self.notification_handler
+        if handler is not None:
+            handler(data)
+        else:
+            self.dropped_notifications.inc()
+
+
+class ConnectionManager:
+    """Owns every BLE link of the process, keyed by device address.
+
+    All methods run on the BLE event loop. Devices seen by the background
+    scanner or by an address lookup are cached for ``DISCOVERY_TTL`` seconds, so a
+    connect only scans when the target has not been seen recently, and then
+    stops as soon as it appears. Connects to the same address are merged and
+    at most ``max_concurrent_connects`` attempts are in flight at once.
+
+    A link that drops without ``disconnect`` being called is reconnected to
+    the same device, with no scan, retrying with exponential backoff for up
+    to ``reconnect_timeout`` seconds before the connection is given up.
+    """
+
+    def __init__(self, max_concurrent_connects=MAX_CONCURRENT_CONNECTS, connect_timeout=CONNECT_TIMEOUT,
+                 transport=None, reconnect_timeout=RECONNECT_TIMEOUT):
+        self.transport = transport or BleakTransport()
+        self.max_concurrent_connects = max_concurrent_connects
+        self.connect_timeout = connect_timeout
+        self.reconnect_timeout = reconnect_timeout
+        self.connections = {}
+        self.scanner = None
+        self.seen = {}
+        self.waiters = {}
+        self.connecting = {}
+        self.connect_slots = None
+        self.connect_durations = deque(maxlen=100)
+
+    def get(self, address):
+        if not address:
+            return None
+        return self.connections.get(address.upper())
+
+    def remember(self, device, advertisement_data=None):
+        address = device.address.upper()
+        self.seen[address] = (device, time.monotonic())
+        waiter = self.waiters.pop(address, None)
+        if waiter is not None:
+            waiter.set()
+
+    def cached_device(self, address):
+        entry = self.seen.get(address)
+        if entry is None:
+            return None
+        device, seen_at = entry
+        if time.monotonic() - seen_at > DISCOVERY_TTL:
+            del self.seen[address]
+            return None
+        return device
+
+    async def start_discovery(self):
+        if self.scanner is not None:
+            return True
+        try:
+            scanner = self.transport.scanner(self.remember)
+            await scanner.start()
+        except Exception:
+            SCANNER_FAILURES.inc()
+            return False
+        self.scanner = scanner
+        return True
+
+    async def timed_scan(self, kind, scan):
+        started = time.perf_counter()
+        try:
+            return await scan
+        finally:
+            SCAN_SECONDS.labels(kind).observe(time.perf_counter() - started)
+
+    async def find_device(self, address):
+        device = self.cached_device(address)
+        if device is not None:
+            return device
+        if self.scanner is not None:
+            waiter = self.waiters.setdefault(address, asyncio.Event())
+            try:
+                await self.timed_scan("advertisement", asyncio.wait_for(waiter.wait(), timeout=SCAN_TIMEOUT))
+            except asyncio.TimeoutError:
+                return None
+            return self.cached_device(address)
+        device = await self.timed_scan("address", self.transport.find_device(address, SCAN_TIMEOUT))
+        if device is not None:
+            self.remember(device)
+        return device
+
+    async def connect(self, address):
+        address = address.upper()
+        connection = self.connections.get(address)
+        if connection and connection.is_connected:
+            return connection
+        if connection and connection.reconnect_task is not None:
+            connection = await asyncio.shield(connection.reconnect_task)
+            if connection is not None:
+                return connection
+        task = self.connecting.get(address)
+        if task is None:
+            task = asyncio.ensure_future(self._connect(address))
+            task.add_done_callback(self.count_failure)
+            self.connecting[address] = task
+            task.add_done_callback(lambda _: self.connecting.pop(address, None))
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def count_failure(task):
+        if task.cancelled() or task.exception() is not None or not (task.result() and task.result().is_connected):
+            CONNECT_FAILURES.inc()
+
+    async def _connect(self, address):
+        if self.connect_slots is None:
+            self.connect_slots = asyncio.Semaphore(self.max_concurrent_connects)
+        started = time.perf_counter()
+        device = await self.find_device(address)
+        if device is None:
+            return None
+        async with self.connect_slots:
+            client = self.transport.client(device, functools.partial(self.on_disconnect, address))
+            await asyncio.wait_for(client.connect(), timeout=self.connect_timeout)
+        connection = DeviceConnection(address, client, device)
+        if connection.is_connected:
+            connection.connect_seconds = time.perf_counter() - started
+            self.connect_durations.append(connection.connect_seconds)
+            CONNECT_SECONDS.observe(connection.connect_seconds)
+            self.connections[address] = connection
+        return connection
+
+    def on_disconnect(self, address, client):
+        connection = self.connections.get(address)
+        # Requested disconnects, replaced clients and attempts made while
+        # reconnecting are not new drops.
+        if connection is None or connection.client is not client or connection.reconnect_task is not None:
+            return
+        DISCONNECTS.labels(address).inc()
+        connection.disconnected_at = time.monotonic()
+        connection.reconnect_task = asyncio.ensure_future(self.reconnect(connection))
+
+    async def reconnect(self, connection):
+        deadline = connection.disconnected_at + self.reconnect_timeout
+        delay = RECONNECT_DELAY
+        try:
+            while time.monotonic() + delay < deadline:
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, RECONNECT_MAX_DELAY)
+                client = self.transport.client(connection.device,
+                                               functools.partial(self.on_disconnect, connection.address))
+                try:
+                    async with self.connect_slots:
+                        await asyncio.wait_for(client.connect(), timeout=min(RECONNECT_ATTEMPT_TIMEOUT,
+                                                                             deadline - time.monotonic()))
+                    if not client.is_connected:
+                        continue
+                    connection.client = client
+                    await connection.restore()
+                except Exception:
+                    # Not back yet, or dropped again while restoring; try again.
+                    if client.is_connected:
+                        try:
+                            await asyncio.wait_for(client.disconnect(), timeout=DISCONNECT_TIMEOUT)
+                        except Exception:
+                            pass
+                    continue
+                RECONNECT_SECONDS.observe(time.monotonic() - connection.disconnected_at)
+                return connection
+            RECONNECT_FAILURES.inc()
+            if self.connections.get(connection.address) is connection:
+                del self.connections[connection.address]
+            connection.lost.set()
+            return None
+        finally:
+            connection.reconnect_task = None
+
+    async def disconnect(self, address):
+        connection = self.connections.pop(address.upper(), None)
+        if connection is None:
+            return None
+        if connection.reconnect_task is not None:
+            connection.reconnect_task.cancel()
+        connection.lost.set()
+        if connection.is_connected:
+            await asyncio.wait_for(connection.client.disconnect(), timeout=DISCONNECT_TIMEOUT)
+        return connection
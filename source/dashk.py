@@ -1,212 +1,310 @@
 import dash
 from dash import html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ALL, ClientsideFunction, Input, Output, State
 import dash_bootstrap_components as dbc
 from dash import dcc
 import flask
+import json
+import math
+import multiprocessing
+import os
 import secrets
+import sys
+import time
 from flask import session
-from bleak import BleakClient, BleakScanner
+from werkzeug.utils import secure_filename
 import asyncio
+import concurrent.futures
 import threading
 import uuid
-import pandas as pd
+from analysis import RHYTHM_HOP, RHYTHM_MIN_WINDOW, RHYTHM_WINDOW, AnalysisExecutor
+from buffers import Subscription, decode_samples
+from captures import CAPTURE_TTL, RECORD_CAPTURES, CaptureStore
+from capture_file import CaptureFile
+from connections import BleakTransport, ConnectionManager
+from export import EXPORT_FORMATS, csv_chunks, gzip_chunks, parquet_chunks, raw_chunks, sample_range
+from gateway import GatewayClient, GatewayError, GatewayServer
+from metrics import CONTENT_TYPE, REGISTRY
+from patients import PatientStore
+from simulator import SimulatedTransport
+from vitals import CHANNELS, SAMPLE_RATE
+from protocol import (characteristics_uuid, heart_rate_command_bytes, service_uuid,
+                      turn_off_led_command, write_commands)
 from datetime import datetime
-import plotly.graph_objects as go
 
 import warnings
 
 warnings.filterwarnings("ignore")
 
-clients = {}
-service_uuid = "fe8a042a-c4e3-11ea-87d0-0242ac130003"
-characteristics_uuid = "fe8a0438-c4e3-11ea-87d0-0242ac130003"
-
-heart_rate_commands = [0x806400, 0x80710403000000, 0xc070010101, 0xc0700203000000, 0xc070030100,
-                       0xc07005020000, 0x80720100, 0xc072020a00000000000000000000,
-                       0xc072030c000000000000000000000000,
-                       0xc072052c0000000000000000000000000000000000000000000000000000000000000000010000000000000000000000,
-                       0xc072045c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000,
-                       0x807604a0860100,
-                       0x806617000700073f000000000402040003101004000310101010,
-                       0x80660701000048000000,
-                       0x80661a0257000000000009000000000000001500010000000000000000,
-                       0x8066170300020000000000000000000000000000000000000000,
-                       0x8066170400000000000000000000000000000000000000000000,
-                       0x80660a05000000a76403075707,
-                       0x80661606000000000000000000000000000000000000000000,
-                       0x80660c070303000000000000000000,
-                       0x80667b0800000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000,
-                       0x80661e090700000a9f0001000000000000000000004f0000000000000000010000,
-                       0x8066060a0000000000, 0x8066030b0000,
-                       0x806814000101051e0519320600000090d00300d0bf0b00,
-                       0x806c00, 0x806900, 0x807700, 0x806e00]
-
+DEVICE_ADDRESS = "CA:DE:07:50:DE:0C"
+# "simulated" replaces the radio with SIMULATED_DEVICES synthetic wristbands,
+# the first of them at DEVICE_ADDRESS.
+BLE_TRANSPORT = os.environ.get("BLE_TRANSPORT", "bleak")
+connection_manager = ConnectionManager(transport=SimulatedTransport(addresses=[DEVICE_ADDRESS])
+                                       if BLE_TRANSPORT == "simulated" else BleakTransport())
+BACKGROUND_SCAN = True
+pending_operations = {}
+measurements = {}
+acquisitions = {}
+analysis_executor = AnalysisExecutor()
+patient_store = PatientStore()
+capture_store = CaptureStore(locate=patient_store.recording_path)
+for patient_id in ["Chiranjeevi", "Mahesh"]:
+    patient_store.add_patient(patient_id)
+HISTORY_DAYS = 28
+HISTORY_MEASUREMENTS = 10
+# Default measurement length in seconds; 0 measures until Stop is pressed.
+MEASUREMENT_SECONDS = int(os.environ.get("MEASUREMENT_SECONDS", "60"))
+MEASUREMENT_DURATIONS = sorted({10, 30, 60, 300, 0, MEASUREMENT_SECONDS}, key=lambda seconds: seconds or float("inf"))
+PLOT_WINDOW = 1000
+SAMPLES_PAGE = 2 ** 18
+# SpO2 needs the red and infrared channels; a single-channel wristband says so
+# instead of waiting for a value that never comes.
+SPO2_UNAVAILABLE = "N/A"
+# The last vitals tick of a measurement waits this long for its rhythm, as no
+# further tick will pick it up.
+RHYTHM_WAIT = 5
+STREAM_KEEPALIVE = 15
+# Each /stream response holds a server thread for as long as its capture
+# runs. Past this many per process, viewers poll the graph interval instead,
+# so keep it below the worker's thread count.
+STREAM_LIMIT = int(os.environ.get("STREAM_LIMIT", "4"))
+# /export responses hold a thread, and compress, for as long as the client
+# takes to download them. Past this many at once the next gets a 503.
+EXPORT_LIMIT = int(os.environ.get("EXPORT_LIMIT", "2"))
+EXPORT_RETRY = 30
+REPLAY_SPEEDS = [0.5, 1, 2, 5, 10]
+REPLAY_TICK = 50
+# With BLE_GATEWAY_SOCKET set, web workers leave the BLE links to the
+# process started with --gateway and reach it over that Unix socket.
+GATEWAY_SOCKET = os.environ.get("BLE_GATEWAY_SOCKET")
+SERVE_GATEWAY = '--gateway' in sys.argv
+REMOTE_BLE = GATEWAY_SOCKET is not None and not SERVE_GATEWAY
+ble_loop = asyncio.new_event_loop()
 server = flask.Flask(__name__)
 app = dash.Dash(__name__,
                 server=server,
                 external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP],
                 suppress_callback_exceptions=True,
                 meta_tags=[{'name': 'viewport', 'content': 'width=device-width, initial-scale=1'}])
-app.server.secret_key = secrets.token_hex(16)
+app.server.secret_key = os.environ.get("SECRET_KEY") or secrets.token_hex(16)
+
+GATT_SETUP_SECONDS = REGISTRY.histogram("ble_gatt_setup_seconds",
+                                        "Time from resolving the characteristic to the last handshake command.")
+GATT_COMMAND_SECONDS = REGISTRY.histogram("ble_gatt_command_seconds",
+                                          "Duration of each handshake command write, by its position in the "
+                                          "handshake and its first three bytes in hex.", ["command", "opcode"])
+DECODE_SECONDS = REGISTRY.histogram("ppg_decode_seconds", "Time to decode one notification into its capture.",
+                                    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.01))
+TRUNCATED_NOTIFICATIONS = REGISTRY.counter("ppg_truncated_notifications_total",
+                                           "Notifications with an odd trailing byte that was dropped.")
+STREAM_DROPPED_SAMPLES = REGISTRY.counter("stream_dropped_samples_total",
+                                          "Samples skipped by /stream viewers that fell behind.")
+STREAM_REJECTED = REGISTRY.counter("stream_rejected_total",
+                                   "/stream requests turned away at STREAM_LIMIT; those viewers poll instead.")
+EXPORT_REJECTED = REGISTRY.counter("export_rejected_total", "/export requests turned away at EXPORT_LIMIT.")
+AGGREGATE_FAILURES = REGISTRY.counter("ppg_aggregate_failures_total",
+                                      "Finished recordings whose per-window aggregates were not stored.")
+CALLBACK_SECONDS = REGISTRY.histogram("dash_callback_seconds", "Server time per Dash callback request.",
+                                      ["callback"])
 
 
-async def scan_and_connect(device_mac_address, session_id):
-    session_info = clients.get(session_id)
-    if session_info and session_info.get("connected"):
-        session['connection_status'] = 'Connected'
-        session['connection_status_color'] = "success"
+async def scan_and_connect(device_mac_address):
+    connection = connection_manager.get(device_mac_address)
+    if connection and connection.is_connected:
         return {
             "status": "already_connected",
-            "message": f"Successfully connected to device {device_mac_address}!"
+            "message": f"Successfully connected to device {device_mac_address}!",
+            "device_address": connection.address,
+            "connection_status": 'Connected',
+            "connection_status_color": "success"
         }
-    else:
-        try:
-            devices = await BleakScanner.discover()
-            for device in devices:
-                if device.address == device_mac_address:
-                    Client = BleakClient(device.address)
-                    await asyncio.wait_for(Client.connect(), timeout=20)
-                    if Client.is_connected:
-                        clients[session_id] = {
-                            "client": Client,
-                            "connected": True
-                        }
-                        session['connection_status'] = 'Connected'
-                        session['connection_status_color'] = "success"
-
-                        return {
-                            "status": "success",
-                            "message": f"Successfully connected to device {device_mac_address}!"
-                        }
-                    else:
-                        session['connection_status'] = 'Not Connected'
-                        session['connection_status_color'] = "danger"
-                        return {
-                            "status": "failure",
-                            "message": f"Failed to connect to device {device_mac_address}."
-                        }
-            else:
-                session['connection_status'] = 'No Device found'
-                session['connection_status_color'] = "danger"
-                return {
-                    "status": "device_failure",
-                    "message": f"No device found {device_mac_address}."
-                }
-
-        except Exception as e:
-            session['connection_status'] = 'Connect Again'
-            session['connection_status_color'] = "danger"
+    try:
+        connection = await connection_manager.connect(device_mac_address)
+        if connection is None:
             return {
-                "status": "error",
-                "message": f"An error occurred: {e}"
+                "status": "device_failure",
+                "message": f"No device found {device_mac_address}.",
+                "connection_status": 'No Device found',
+                "connection_status_color": "danger"
             }
-
-
-async def disconnect(session_id):
-    try:
-        session_info = clients.get(session_id)
-        if not session_info:
-            session['connection_status'] = 'No active device'
-            session['connection_status_color'] = "danger"
+        if connection.is_connected:
             return {
-                "status": "No_active",
-                "message": "No active session to disconnect."
+                "status": "success",
+                "message": f"Successfully connected to device {device_mac_address} "
+                           f"in {connection.connect_seconds:.2f} s!",
+                "device_address": connection.address,
+                "connect_seconds": connection.connect_seconds,
+                "connection_status": 'Connected',
+                "connection_status_color": "success"
             }
+        return {
+            "status": "failure",
+            "message": f"Failed to connect to device {device_mac_address}.",
+            "connection_status": 'Not Connected',
+            "connection_status_color": "danger"
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"An error occurred: {e}",
+            "connection_status": 'Connect Again',
+            "connection_status_color": "danger"
+        }
+
 
-        Client = session_info.get("client")
-        if not Client:
-            session['connection_status'] = 'No active device'
-            session['connection_status_color'] = "danger"
+async def disconnect(device_address):
+    try:
+        connection = connection_manager.get(device_address)
+        if not connection:
             return {
                 "status": "No_active",
-                "message": "No active client to disconnect."
+                "message": "No active session to disconnect.",
+                "connection_status": 'No active device',
+                "connection_status_color": "danger"
             }
 
-        if Client.is_connected:
+        if connection.is_connected:
             try:
-                await asyncio.wait_for(Client.disconnect(), timeout=10)
+                await connection_manager.disconnect(device_address)
             except asyncio.TimeoutError:
-                session['connection_status'] = 'Disconnect Again'
-                session['connection_status_color'] = "danger"
                 return {
                     "status": "failure",
-                    "message": "Timeout occurred while disconnecting."
-                }
-            finally:
-                clients.pop(session_id, None)
-                session['connection_status'] = 'Disconnected'
-                session['connection_status_color'] = "danger"
-                return {
-                    "status": "success",
-                    "message": "Successfully disconnected!"
+                    "message": "Timeout occurred while disconnecting.",
+                    "device_address": None,
+                    "connection_status": 'Disconnect Again',
+                    "connection_status_color": "danger"
                 }
+            return {
+                "status": "success",
+                "message": "Successfully disconnected!",
+                "device_address": None,
+                "connection_status": 'Disconnected',
+                "connection_status_color": "danger"
+            }
         else:
-            session['connection_status'] = 'No active device'
-            session['connection_status_color'] = "danger"
+            await connection_manager.disconnect(device_address)
             return {
                 "status": "No_active",
-                "message": "No active connection to disconnect."
+                "message": "No active connection to disconnect.",
+                "device_address": None,
+                "connection_status": 'No active device',
+                "connection_status_color": "danger"
             }
     except Exception as e:
-        session['connection_status'] = 'Disconnect Again'
-        session['connection_status_color'] = "success"
         return {
             "status": "error",
-            "message": f"An error occurred: {e}"
+            "message": f"An error occurred: {e}",
+            "connection_status": 'Disconnect Again',
+            "connection_status_color": "success"
         }
 
 
-def run_coroutine(coroutine):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    return loop.run_until_complete(coroutine)
+def run_ble_loop():
+    asyncio.set_event_loop(ble_loop)
+    ble_loop.run_forever()
 
 
-async def read_and_store_gatt_characteristics(session_id, data_storage):
-    byte_arrays = []
-    session_info = clients.get(session_id)
-    if not session_info:
-        session['connection_status'] = 'No active device'
-        session['connection_status_color'] = "danger"
-        return {
-            "status": "No_active",
-            "message": "No active session to Read."
-        }
+def submit_coroutine(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, ble_loop)
 
-    client = session_info.get("client")
-    if not client:
-        session['connection_status'] = 'No active device'
-        session['connection_status_color'] = "danger"
+
+def run_coroutine(coroutine, timeout=None):
+    return submit_coroutine(coroutine).result(timeout)
+
+
+ble_thread = threading.Thread(target=run_ble_loop, name="ble-loop", daemon=True)
+# Spawned analysis workers import this module too; only the parent process
+# runs the pool and the BLE loop.
+if multiprocessing.parent_process() is None:
+    analysis_executor.start()
+    if not REMOTE_BLE:
+        ble_thread.start()
+        if BACKGROUND_SCAN:
+            submit_coroutine(connection_manager.start_discovery())
+
+
+def apply_connection_status(result):
+    session['connection_status'] = result['connection_status']
+    session['connection_status_color'] = result['connection_status_color']
+    if "device_address" in result:
+        session['device_address'] = result['device_address']
+
+
+def poll_pending_operation(session_id):
+    try:
+        operation = ble.poll_operation(session_id)
+    except Exception as e:
+        operation = {"pending": False, "result": {
+            "status": "error",
+            "message": f"An error occurred: {e}",
+            "connection_status": 'Connect Again',
+            "connection_status_color": "danger"
+        }}
+    if operation["result"] is not None:
+        apply_connection_status(operation["result"])
+    return operation["pending"]
+
+
+async def read_and_store_gatt_characteristics(connection, capture, stop_event, duration=MEASUREMENT_SECONDS):
+    # duration is in seconds, 0 or None to measure until stop_event is set.
+    if not connection:
         return {
             "status": "No_active",
-            "message": "No active client to read."
+            "message": "No active session to Read.",
+            "connection_status": 'No active device',
+            "connection_status_color": "danger"
         }
 
+    client = connection.client
     if client.is_connected:
         try:
-            services = await client.get_services()
-            for service in services:
-                if service.uuid == service_uuid:
-                    characteristics = service.characteristics
-                    for characteristic in characteristics:
-                        if characteristic.uuid == characteristics_uuid:
-                            await client.start_notify(characteristics_uuid,
-                                                      lambda sender, data: store_data(session_id, data, data_storage))
-                            byte_arrays.extend([x.to_bytes((x.bit_length() + 7) // 8, 'big')
-                                                for x in heart_rate_commands])
-
-                            for command in byte_arrays:
-                                response = await client.write_gatt_char(characteristics_uuid, command,
-                                                                        response=True)
-                                print("Write successful. Response:", response)
-                            await asyncio.sleep(10)
-                            turn_off_led_command = b'\x80o\x00'
-                            await client.write_gatt_char(characteristics_uuid, turn_off_led_command,
-                                                         response=True)
+            setup_started = time.perf_counter()
+            characteristic = await connection.resolve_characteristic(service_uuid, characteristics_uuid)
+            if characteristic is None:
+                return {
+                    "status": "failure",
+                    "message": "Measurement characteristic not found on device."
+                }
+
+            def handler(data):
+                store_data(data, capture)
+
+            async def start_streaming():
+                characteristic = await connection.resolve_characteristic(service_uuid, characteristics_uuid)
+                await connection.subscribe(handler)
+                connection.command_timings = await write_commands(connection.client, characteristic,
+                                                                  heart_rate_command_bytes)
+
+            async def resume():
+                # A restored link starts from scratch; pick up where the capture left off.
+                await start_streaming()
+                capture.mark_gap(time.monotonic() - connection.disconnected_at)
+
+            connection.resume = resume
+            try:
+                await start_streaming()
+                GATT_SETUP_SECONDS.observe(time.perf_counter() - setup_started)
+                for index, (command, seconds) in enumerate(connection.command_timings):
+                    GATT_COMMAND_SECONDS.labels(str(index), command[:3].hex()).observe(seconds)
+                waiters = [asyncio.ensure_future(stop_event.wait()), asyncio.ensure_future(connection.lost.wait())]
+                await asyncio.wait(waiters, timeout=duration or None, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+                if connection.is_connected:
+                    await connection.client.write_gatt_char(connection.characteristic, turn_off_led_command,
+                                                            response=True)
+            finally:
+                connection.resume = None
+                connection.unsubscribe(handler)
+            if connection.lost.is_set() and not stop_event.is_set():
+                return {
+                    "status": "failure",
+                    "message": f"Connection lost after {capture.samples.count} samples."
+                }
             return {
                 "status": "success",
-                "message": data_storage
+                "message": f"Collected {capture.samples.count} samples."
             }
         except Exception as e:
             return {
@@ -220,23 +318,330 @@ async def read_and_store_gatt_characteristics(session_id, data_storage):
         }
 
 
-async def monitor_connection(client, session_id):
-    while True:
-        if not client.is_connected:
-            print(f"Client disconnected for session {session_id}, updating status...")
-            clients.pop(session_id, None)
-            session['connection_status'] = 'Disconnected'
-            session['connection_status_color'] = "danger"
-            break
-        await asyncio.sleep(1)
+def store_data(data, capture):
+    started = time.perf_counter()
+    samples = decode_samples(data)
+    if len(data) % 2:
+        capture.samples.truncated_bytes += 1
+        TRUNCATED_NOTIFICATIONS.inc()
+    capture.extend(samples)
+    DECODE_SECONDS.observe(time.perf_counter() - started)
+
+
+def store_aggregates(capture, future):
+    if not future.cancelled() and future.exception() is None:
+        patient_store.add_aggregates(capture.measurement_id, capture.patient_id, future.result())
+    else:
+        AGGREGATE_FAILURES.inc()
+
+
+def finish_measurement(capture):
+    capture.close()
+    if capture.path and capture.patient_id:
+        patient_store.finish_measurement(capture.measurement_id, capture.samples.count, time.time())
+        try:
+            future = analysis_executor.submit_recording("aggregates", capture.path)
+        except RuntimeError:
+            # The pool is shutting down with the process.
+            AGGREGATE_FAILURES.inc()
+            return
+        future.add_done_callback(lambda done: store_aggregates(capture, done))
+
+
+class BleService:
+    """BLE operations of the process that owns the device connections.
+
+    Connects and disconnects run in the background and are polled per
+    session. Each device runs at most one acquisition at a time and every
+    session measuring that patient on it subscribes to the same capture; the
+    acquisition stops when its last subscriber does. Everything takes and
+    returns plain JSON values, so web workers can call the same methods
+    through a GatewayClient when the links live in a separate gateway
+    process.
+    """
+
+    operations = {"connect": scan_and_connect, "disconnect": disconnect}
+
+    def __init__(self, record=RECORD_CAPTURES):
+        self.record = record
+        self.lock = threading.Lock()
+
+    def start_operation(self, session_id, operation, address):
+        if session_id in pending_operations:
+            return False
+        pending_operations[session_id] = submit_coroutine(self.operations[operation](address))
+        return True
+
+    def poll_operation(self, session_id):
+        future = pending_operations.get(session_id)
+        if future is None or not future.done():
+            return {"pending": future is not None, "result": None}
+        pending_operations.pop(session_id, None)
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {
+                "status": "error",
+                "message": f"An error occurred: {e}",
+                "connection_status": 'Connect Again',
+                "connection_status_color": "danger"
+            }
+        return {"pending": False, "result": result}
+
+    def connected(self, address):
+        connection = connection_manager.get(address)
+        return bool(connection and connection.is_connected)
+
+    def start_measurement(self, session_id, patient_id, address, duration=MEASUREMENT_SECONDS):
+        self.stop_measurement(session_id)
+        address = address.upper()
+        with self.lock:
+            self.forget_unread_results()
+            previous = acquisitions.get(address)
+            if previous is not None and not previous["stopping"] and not previous["future"].done():
+                # Sessions share a running acquisition only when it is
+                # measuring the same patient.
+                if previous["capture"].patient_id != patient_id:
+                    return {
+                        "status": "failure",
+                        "message": "The device is measuring another patient."
+                    }
+                acquisition = previous
+                capture_store.add(acquisition["capture"], session_id)
+            else:
+                acquisition = self.start_acquisition(session_id, patient_id, address, previous, duration)
+            acquisition["subscribers"].add(session_id)
+            measurements[session_id] = acquisition
+        return acquisition["capture"].handle
+
+    def start_acquisition(self, session_id, patient_id, address, previous, duration):
+        capture = capture_store.create(session_id, patient_id, record=self.record)
+        if capture.path:
+            patient_store.add_measurement(capture.measurement_id, patient_id, capture.started.timestamp(),
+                                          capture.path)
+        stop_event = asyncio.Event()
+        acquisition = acquisitions[address] = {
+            "measurement_id": capture.measurement_id,
+            "capture": capture,
+            "subscribers": set(),
+            "stopping": False,
+            "stop": stop_event,
+            "future": submit_coroutine(self.acquire(previous, connection_manager.get(address), capture, stop_event,
+                                                    duration))
+        }
+        acquisition["future"].add_done_callback(lambda _: finish_measurement(capture))
+        acquisition["future"].add_done_callback(lambda _: acquisition.update(ended=time.monotonic()))
+        return acquisition
+
+    async def acquire(self, previous, connection, capture, stop_event, duration):
+        # Let a stopping acquisition on the same device switch its LED off first.
+        if previous is not None:
+            await asyncio.wait([asyncio.wrap_future(previous["future"])])
+        return await read_and_store_gatt_characteristics(connection, capture, stop_event, duration)
+
+    def stop_measurement(self, session_id):
+        with self.lock:
+            measurement = measurements.get(session_id)
+            if measurement is None or measurement["future"].done() or session_id not in measurement["subscribers"]:
+                return False
+            measurement["subscribers"].discard(session_id)
+            if not measurement["subscribers"]:
+                measurement["stopping"] = True
+                ble_loop.call_soon_threadsafe(measurement["stop"].set)
+            return True
+
+    def measurement_result(self, session_id, measurement_id):
+        with self.lock:
+            measurement = measurements.get(session_id)
+            if measurement is None or measurement["measurement_id"] != measurement_id or not measurement["future"].done():
+                return None
+            # Read once; the entry would otherwise keep the capture alive.
+            del measurements[session_id]
+        return measurement["future"].result()
+
+    def forget_unread_results(self):
+        # Sessions that went away before reading their result.
+        now = time.monotonic()
+        for session_id, measurement in list(measurements.items()):
+            if now - measurement.get("ended", now) > CAPTURE_TTL:
+                del measurements[session_id]
+
+    def metrics(self):
+        return REGISTRY.render()
+
+
+def live_acquisitions():
+    return {address: acquisition for address, acquisition in list(acquisitions.items())
+            if not acquisition["future"].done()}
+
+
+REGISTRY.gauge("ppg_buffer_depth_samples", "Samples held in the ring buffer of each running acquisition.",
+               lambda: {(address, ): acquisition["capture"].samples.count - acquisition["capture"].samples.first_index
+                        for address, acquisition in live_acquisitions().items()}, ["device"])
+REGISTRY.gauge("ppg_acquisition_subscribers", "Sessions viewing each running acquisition.",
+               lambda: {(address, ): len(acquisition["subscribers"])
+                        for address, acquisition in live_acquisitions().items()}, ["device"])
+
+
+ble = GatewayClient(GATEWAY_SOCKET) if REMOTE_BLE else BleService(record=SERVE_GATEWAY or RECORD_CAPTURES)
+
+
+def serve_gateway(path):
+    handlers = {op: getattr(ble, op) for op in ("start_operation", "poll_operation", "connected", "start_measurement",
+                                                "stop_measurement", "measurement_result", "metrics")}
+    run_coroutine(GatewayServer(handlers).start(path))
+    print(f"BLE gateway listening on {path}")
+    ble_thread.join()
+
+
+# Static layout fragments and figure layouts are built once at import and
+# shared by every response that includes them; callbacks only add the
+# per-capture parts.
+HEADER = html.Div([
+    html.Br(),
+    html.H3("Unlocking insights into your health with Data-Driven analysis",
+            style={'marginLeft': '20px', 'color': '#ffffff', 'fontFamily': 'sans-serif', 'textAlign': 'left'}),
+    html.P("Gain a deeper understanding of your well-being through your Physiological Signals",
+           style={'marginLeft': '20px', 'color': '#ffffff', 'fontSize': '15px'}),
+], style={'marginLeft': '50px'}, className="g-3")
+
+
+def metric_card(icon, label, value_id, color="#3efb47"):
+    return dbc.Col([
+        dbc.Card([
+            dbc.CardBody([
+                html.Div([
+                    html.I(className=f"bi {icon}", style={"font-size": "2rem", "color": "#ffffff"}),
+                    html.P(label, className="card-text", style={"color": "#ffffff"}),
+                    html.P("--", id=value_id, className="card-text", style={"color": color}),
+                ], style={"textAlign": "center"})
+            ])
+        ], className="mb-4", style={"maxWidth": "540px", "border": "none"}, color="black")
+    ], xs=12, sm=12, md=6, lg=2, xl=2)
+
+
+METRIC_CARDS = html.Div([
+    dbc.Container([
+        html.Div([
+            dbc.Row([
+                metric_card("bi-heart-fill", "Heart Rate", "heart-rate-value"),
+                metric_card("bi-droplet", "SPO2", "spo2-value"),
+                metric_card("bi-heart-pulse-fill", "Blood Pressure", "blood-pressure-value"),
+                metric_card("bi-activity", "Electrocardiogram", "rhythm-value", color="#ffffff"),
+                metric_card("bi-lungs", "Respiration Rate", "respiration-rate-value"),
+            ], justify="around", className="g-3"),
+        ], style={'marginLeft': '50px'}, className="g-3"),
+    ], fluid=True),
+])
+
+GRID_COLOR = 'rgba(128,128,128,0.2)'
+# Plain-dict figures skip plotly.graph_objects validation and its default
+# template, so the few template settings the charts relied on are spelled out.
+FIGURE_STYLE = {'plot_bgcolor': 'black', 'paper_bgcolor': 'black', 'font': {'color': 'white'}, 'hovermode': 'closest'}
+PPG_FIGURE_LAYOUT = dict(
+    FIGURE_STYLE,
+    height=500,
+    title={'text': 'OPTICAL AND ELECTRICAL SIGNALS', 'font': {'color': '#ffffff'}, 'x': 0.05},
+    xaxis={'title': {'text': 'TimeStamp[Sec]', 'font': {'color': '#ffffff'}, 'standoff': 15}, 'tickangle': -45,
+           'tickfont': {'size': 10, 'color': 'white'}, 'showgrid': True, 'gridcolor': GRID_COLOR, 'gridwidth': 1,
+           'zeroline': False, 'linecolor': 'rgb(204, 204, 204)', 'linewidth': 2, 'automargin': True},
+    yaxis={'title': {'text': 'Amplitude', 'font': {'color': '#ffffff'}, 'standoff': 15},
+           'tickfont': {'color': 'white'}, 'showgrid': True, 'gridcolor': GRID_COLOR, 'gridwidth': 1,
+           'zeroline': False, 'linecolor': 'rgb(204, 204, 204)', 'linewidth': 2, 'automargin': True},
+    uirevision='capture'
+)
+TREND_FIGURE_LAYOUT = dict(
+    FIGURE_STYLE,
+    height=350,
+    title={'text': 'HISTORY', 'font': {'color': '#ffffff'}, 'x': 0.05},
+    xaxis={'tickfont': {'color': 'white'}, 'showgrid': True, 'gridcolor': GRID_COLOR, 'automargin': True},
+    yaxis={'title': {'text': 'BPM'}, 'tickfont': {'color': 'white'}, 'showgrid': True, 'gridcolor': GRID_COLOR,
+           'automargin': True},
+    yaxis2={'title': {'text': 'SPO2 [%]'}, 'tickfont': {'color': 'white'}, 'overlaying': 'y', 'side': 'right',
+            'showgrid': False, 'automargin': True}
+)
+
+
+def make_ppg_figure():
+    return {
+        'data': [{'type': 'scatter', 'x': [], 'y': [], 'mode': 'lines', 'name': 'PPG', 'line': {'color': 'blue'}}],
+        'layout': PPG_FIGURE_LAYOUT
+    }
+
+
+def make_trend_figure(trend):
+    times = [datetime.fromtimestamp(t) for t in trend["window_start"]]
+    return {
+        'data': [
+            {'type': 'scatter', 'x': times, 'y': trend["heart_rate_max"], 'mode': 'lines', 'name': 'Max HR',
+             'line': {'width': 0}, 'showlegend': False},
+            {'type': 'scatter', 'x': times, 'y': trend["heart_rate_min"], 'mode': 'lines', 'name': 'Min HR',
+             'line': {'width': 0}, 'fill': 'tonexty', 'fillcolor': 'rgba(62,251,71,0.2)', 'showlegend': False},
+            {'type': 'scatter', 'x': times, 'y': trend["heart_rate_mean"], 'mode': 'lines+markers',
+             'name': 'Heart Rate', 'line': {'color': '#3efb47'}},
+            {'type': 'scatter', 'x': times, 'y': trend["spo2"], 'mode': 'lines+markers', 'name': 'SPO2',
+             'line': {'color': '#00bfff'}, 'yaxis': 'y2'},
+        ],
+        'layout': TREND_FIGURE_LAYOUT
+    }
+
+
+PLOT_PANEL = html.Div([
+    html.P(id='plot-status', className='card-title', style={"color": "red"}),
+    html.Div([
+        dbc.Button('Replay', id='replay-button', color='primary', size='sm',
+                   style={"backgroundColor": "transparent", "width": "80px"}),
+        html.Span("Speed", style={"color": "#ffffff", "marginLeft": "20px"}),
+        dcc.Dropdown(id='replay-speed', options=[{'label': f"{j:g}x", 'value': j} for j in REPLAY_SPEEDS],
+                     value=1, clearable=False, style={"width": "90px", "marginLeft": "10px"}),
+        html.Span("Window [Sec]", style={"color": "#ffffff", "marginLeft": "20px"}),
+        dcc.Input(id='plot-window', type='number', min=1, step=1,
+                  value=PLOT_WINDOW // (SAMPLE_RATE * CHANNELS), style={"width": "80px", "marginLeft": "10px"}),
+    ], style={'display': 'flex', 'alignItems': 'center', 'marginLeft': '70px'}),
+    dcc.Graph(id='ppg-graph', figure=make_ppg_figure()),
+], id='output-div-plots')
 
+REPLAY_STATE = {"playing": False, "position": 0, "rate": SAMPLE_RATE * CHANNELS}
+PLOT_STATE = [
+    dcc.Store(id='graph-cursor', data={"live": True}),
+    dcc.Store(id='live-stream', data={"rate": SAMPLE_RATE * CHANNELS}),
+    dcc.Store(id='replay', data=REPLAY_STATE),
+    dcc.Interval(id='replay-interval', interval=REPLAY_TICK, n_intervals=0, disabled=True),
+    dcc.Interval(
+        id='graph-interval-component',
+        interval=1000,
+        n_intervals=0,
+        disabled=True
+    ),
+]
+# Rendered once per patient and hidden until a capture is shown in it;
+# starting or opening a measurement then only sends show_capture's values.
+MEASUREMENT_PANEL = html.Div([dcc.Store(id='stored-data'), METRIC_CARDS, PLOT_PANEL] + PLOT_STATE,
+                             id='measurement-panel', style={'display': 'none'})
 
-def store_data(session_id, data, data_storage):
-    hexadecimal_data = data.hex()
-    integers = [int(hexadecimal_data[i:i + 4], 16) for i in range(0, len(hexadecimal_data), 4)]
-    if session_id not in data_storage:
-        data_storage[session_id] = []
-    data_storage[session_id].extend(integers)
+MEASUREMENT_CONTROLS = [
+    html.Div([
+        html.H1('Vital Measurement', className='card-title', style={"color": "#ffffff"}),
+        dbc.Button('Measure/Start Measurement', id='start-measurement-button', color='primary',
+                   className='mt-2', style={"backgroundColor": "transparent"}),
+        dbc.Button('Stop Measurement', id='stop-measurement-button', color='primary',
+                   className='mt-2 ms-2', style={"backgroundColor": "transparent"}),
+        html.Div([
+            html.Span("Duration", style={"color": "#ffffff"}),
+            dcc.Dropdown(id='measurement-duration', value=MEASUREMENT_SECONDS, clearable=False,
+                         options=[{'label': f"{j} s" if j else "Until Stop", 'value': j}
+                                  for j in MEASUREMENT_DURATIONS],
+                         style={"width": "130px", "marginLeft": "10px"}),
+        ], className='mt-2', style={'display': 'flex', 'alignItems': 'center', 'justifyContent': 'center'}),
+        html.P(id='measurement-status', style={"color": "#ffffff", "marginTop": "10px"}),
+    ], style={'width': '50%', 'margin': 'auto', 'textAlign': 'center'}),
+    html.Br(),
+    html.Hr(style={'size': '10', 'borderColor': '#ffffff', 'borderHeight': "20vh",
+                   'marginLeft': '70px', 'marginRight': '70px'}),
+    html.Br(),
+    html.P(id='measurement-message', className='card-title', style={"color": "red", 'textAlign': 'center'}),
+    MEASUREMENT_PANEL,
+]
 
 
 app.layout = html.Div([
@@ -252,22 +657,13 @@ app.layout = html.Div([
                                     style={'margin': '10px', 'width': '150px'})
             ),
         ], style={'display': 'flex', 'justify-content': 'flex-end', 'margin': '0px'}),
-        html.Div([
-            html.Br(),
-            html.H3("Unlocking insights into your health with Data-Driven analysis", style={'marginLeft': '20px',
-                                                                                            'color': '#ffffff',
-                                                                                            'fontFamily': 'sans-serif',
-                                                                                            'textAlign': 'left'}),
-            html.P(
-                "Gain a deeper understanding of your well-being through your Physiological Signals",
-                style={'marginLeft': '20px', 'color': '#ffffff', 'fontSize': '15px'}),
-        ], style={'marginLeft': '50px'}, className="g-3"),
+        HEADER,
         html.Br(),
         html.Div([
             dbc.Row([
                 dbc.Col(dcc.Dropdown(
                     id="patient-id-db",
-                    options=[{'label': j, 'value': j} for j in ["Chiranjeevi", "Mahesh"]],
+                    options=[],
                     placeholder="Patient_id",
                     style={"height": "40px", 'borderRadius': '10px'}
                 ), xs=12, sm=12, md=6, lg=8, xl=8),
@@ -282,7 +678,8 @@ app.layout = html.Div([
         html.Hr(style={'size': '10', 'borderColor': '#ffffff', 'borderHeight': "20vh",
                        'marginLeft': '70px', 'marginRight': '70px'}),
         html.Br(),
-        html.Div(id="output-div-measurement")
+        html.Div(id="output-div-measurement"),
+        dcc.Interval(id='connection-interval', interval=500, n_intervals=0, disabled=True)
     ], fluid=True),
 ], style={
     'backgroundColor': 'black',
@@ -293,33 +690,56 @@ app.layout = html.Div([
     'padding': '0'
 })
 
+@app.callback(
+    Output('patient-id-db', 'options'),
+    Input('patient-id-db', 'search_value'),
+    State('patient-id-db', 'value')
+)
+def load_patient_options(search_value, patient_id):
+    patients = patient_store.search_patients(search_value)
+    if patient_id and patient_id not in patients:
+        patients.insert(0, patient_id)
+    return [{'label': j, 'value': j} for j in patients]
+
+
 @app.callback(
     Output('status-button', 'children'),
     Output('status-button', 'color'),
+    Output('connection-interval', 'disabled'),
     [Input('connect-button', 'n_clicks'),
-     Input('disconnect-button', 'n_clicks')],
+     Input('disconnect-button', 'n_clicks'),
+     Input('connection-interval', 'n_intervals')],
     [State('connect-button', 'n_clicks_timestamp'),
-     State('disconnect-button', 'n_clicks_timestamp')]
+     State('disconnect-button', 'n_clicks_timestamp'),
+     State('patient-id-db', 'value')]
 )
-def manage_ble_connection(connect_clicks, disconnect_clicks, connect_timestamp, disconnect_timestamp):
+def manage_ble_connection(connect_clicks, disconnect_clicks, n_intervals, connect_timestamp, disconnect_timestamp,
+                          patient_id):
     session_id = session.get('session_id')
-    device_mac_address = "CA:DE:07:50:DE:0C"
+    # Patients without a wristband of their own use the ward's default one.
+    device_mac_address = (patient_id and patient_store.device_for(patient_id)) or DEVICE_ADDRESS
+
+    if dash.callback_context.triggered_id == 'connection-interval':
+        pending = poll_pending_operation(session_id)
+        return session['connection_status'], session['connection_status_color'], not pending
 
     if connect_clicks is None and disconnect_clicks is None:
         session['session_id'] = str(uuid.uuid4())
         session['connection_status'] = "No active device"
         session['connection_status_color'] = "danger"
-        return session['connection_status'], session['connection_status_color']
+        return session['connection_status'], session['connection_status_color'], True
 
     if connect_timestamp is not None and (disconnect_timestamp is None or connect_timestamp > disconnect_timestamp):
-        run_coroutine(scan_and_connect(device_mac_address, session_id))
+        if ble.start_operation(session_id, "connect", device_mac_address):
+            session['connection_status'] = 'Connecting...'
+            session['connection_status_color'] = "warning"
 
     if disconnect_timestamp is not None and (connect_timestamp is None or disconnect_timestamp > connect_timestamp):
-        run_coroutine(disconnect(session_id))
+        if ble.start_operation(session_id, "disconnect", session.get('device_address')):
+            session['connection_status'] = 'Disconnecting...'
+            session['connection_status_color'] = "warning"
 
-    print(session)
-    print(clients)
-    return session['connection_status'], session['connection_status_color']
+    return session['connection_status'], session['connection_status_color'], False
 
 
 @app.callback(
@@ -330,277 +750,471 @@ def manage_ble_connection(connect_clicks, disconnect_clicks, connect_timestamp,
 def submit_patient_id(n_clicks, patient_id):
     if n_clicks is not None:
         if patient_id:
-            return html.Div([
-                html.Div([
-                    html.H1('Vital Measurement', className='card-title', style={"color": "#ffffff"}),
-                    dbc.Button('Measure/Start Measurement', id='start-measurement-button', color='primary',
-                               className='mt-2', style={"backgroundColor": "transparent"}),
-                ], style={'width': '50%', 'margin': 'auto', 'textAlign': 'center'}),
-                html.Br(),
-                html.Hr(style={'size': '10', 'borderColor': '#ffffff', 'borderHeight': "20vh",
-                               'marginLeft': '70px', 'marginRight': '70px'}),
-                html.Br(),
-                html.Div(id="measurement-output")
-            ])
+            return html.Div(MEASUREMENT_CONTROLS + [html.Div(patient_history(patient_id), id="patient-history")])
         else:
             return html.Div([
                 html.P('Please select the patient', className='card-title', style={"color": "red"}),
             ], style={'width': '50%', 'margin': 'auto', 'textAlign': 'center'}),
 
 
+def capture_outputs(allow_duplicate=False):
+    # Everything show_capture resets when the panel switches to another
+    # capture. The first three belong to start_data_collection.
+    return [
+        Output('stored-data', 'data', allow_duplicate=allow_duplicate),
+        Output('measurement-panel', 'style', allow_duplicate=allow_duplicate),
+        Output('measurement-message', 'children', allow_duplicate=allow_duplicate),
+        Output('ppg-graph', 'figure', allow_duplicate=True),
+        Output('graph-cursor', 'data', allow_duplicate=True),
+        Output('plot-status', 'children', allow_duplicate=True),
+        Output('graph-interval-component', 'disabled', allow_duplicate=True),
+        Output('replay', 'data', allow_duplicate=True),
+        Output('heart-rate-value', 'children', allow_duplicate=True),
+        Output('spo2-value', 'children', allow_duplicate=True),
+        Output('respiration-rate-value', 'children', allow_duplicate=True),
+        Output('rhythm-value', 'children', allow_duplicate=True),
+        Output('rhythm-value', 'style', allow_duplicate=True),
+    ]
+
+
+def show_capture(capture):
+    figure = dash.Patch()
+    figure['data'][0].update({'x': [], 'y': []})
+    # A new capture starts unzoomed, a redraw of the same one keeps the view.
+    figure['layout']['uirevision'] = capture.measurement_id
+    return (capture.handle, {'display': 'block'}, None, figure, {"live": True}, None, False, REPLAY_STATE,
+            "--", "--" if CHANNELS == 2 else SPO2_UNAVAILABLE, "--", "--", {"color": "#ffffff"})
+
+
+def show_message(message):
+    return (dash.no_update, dash.no_update, message) + (dash.no_update,) * (len(capture_outputs()) - 3)
+
+
 @app.callback(
-    Output('measurement-output', 'children'),
+    *capture_outputs(),
     Input('start-measurement-button', 'n_clicks'),
+    State('patient-id-db', 'value'),
+    State('measurement-duration', 'value'),
     prevent_initial_call=True
 )
-def start_data_collection(n_clicks):
+def start_data_collection(n_clicks, patient_id, duration):
     session_id = session.get('session_id')
     if n_clicks is None:
-        return dash.no_update
+        return show_message(dash.no_update)
 
-    data_storage = {}
-    result = run_coroutine(read_and_store_gatt_characteristics(session_id, data_storage))
+    if not ble.connected(session.get('device_address')):
+        return show_message("No active session to Read.")
 
-    if result['status'] == 'success':
-        data = result["message"][session_id]
-        df = pd.DataFrame(data, columns=["Data"])
-    else:
-        return html.Div([
-            html.P(result["message"], className='card-title', style={"color": "red"}),
-        ], style={'width': '50%', 'margin': 'auto', 'textAlign': 'center'}),
+    # The connection may have been made for another patient; never record
+    # one patient's wristband under someone else's name.
+    device_mac_address = (patient_id and patient_store.device_for(patient_id)) or DEVICE_ADDRESS
+    if patient_id and device_mac_address != session.get('device_address'):
+        return show_message(f"Connected to {session.get('device_address')}, but {patient_id} wears "
+                            f"{device_mac_address}. Disconnect and connect again to measure this patient.")
+
+    handle = ble.start_measurement(session_id, patient_id, session.get('device_address'),
+                                   MEASUREMENT_SECONDS if duration is None else duration)
+    if handle.get("status") == "failure":
+        return show_message(handle["message"])
+    capture = capture_store.get(session_id, handle)
+    if capture is None:
+        return show_message("Please select the patient")
+    return show_capture(capture)
 
+
+@app.callback(
+    *capture_outputs(allow_duplicate=True),
+    Input({'type': 'open-recording', 'index': ALL}, 'n_clicks'),
+    prevent_initial_call=True
+)
+def open_recording(n_clicks):
+    if not any(n_clicks):
+        return show_message(dash.no_update)
+    measurement = patient_store.measurement(dash.callback_context.triggered_id['index'])
+    if measurement is None or not measurement['path']:
+        return show_message(dash.no_update)
+    try:
+        capture = capture_store.open_recording(session.get('session_id'), measurement['path'],
+                                               measurement['patient_id'])
+    except (OSError, ValueError) as e:
+        return show_message(f"Recording unavailable: {e}")
+    return show_capture(capture)
+
+
+#
+@app.callback(
+    Output('measurement-status', 'children'),
+    Input('stop-measurement-button', 'n_clicks'),
+    prevent_initial_call=True
+)
+def stop_data_collection(n_clicks):
+    if ble.stop_measurement(session.get('session_id')):
+        return "Measurement stopped."
+    return "No measurement running."
+
+
+def patient_history(patient_id):
+    since = datetime.now().timestamp() - HISTORY_DAYS * 24 * 3600
+    past = patient_store.measurements(patient_id, since=since, limit=HISTORY_MEASUREMENTS)
+    if not past:
+        return html.P("No past measurements.", style={"color": "#ffffff", "textAlign": "center"})
+    trend = patient_store.trend(patient_id, since=since)
     return html.Div([
-        dcc.Store(id='stored-data', data=df.to_dict('records')),
-        html.Div([
-            dbc.Container([
-                html.Div([
-                    dbc.Row([
-                        dbc.Col(
-                            [
-                                dbc.Card(
-                                    [
-                                        dbc.CardBody(
-                                            [
-                                                html.Div(
-                                                    [
-                                                        html.I(className="bi bi-heart-fill",
-                                                               style={"font-size": "2rem", "color": "#ffffff"}),
-                                                        html.P("Heart Rate", className="card-text",
-                                                               style={"color": "#ffffff"}),
-                                                        html.P("60 BPM", className="card-text",
-                                                               style={"color": "#3efb47"}),
-                                                    ],
-                                                    style={"textAlign": "center"}
-                                                )
-                                            ]
-                                        )
-                                    ],
-                                    className="mb-4",
-                                    style={"maxWidth": "540px", "border": "none"},
-                                    color="black",
-                                )
-                            ],
-                            xs=12, sm=12, md=6, lg=2, xl=2
-                        ),
-                        dbc.Col(
-                            [
-                                dbc.Card(
-                                    [
-                                        dbc.CardBody(
-                                            [
-                                                html.Div(
-                                                    [
-                                                        html.I(className="bi bi-droplet",
-                                                               style={"font-size": "2rem", "color": "#ffffff"}),
-                                                        html.P("SPO2", className="card-text",
-                                                               style={"color": "#ffffff"}),
-                                                        html.P("97%", className="card-text",
-                                                               style={"color": "#3efb47"}),
-                                                    ],
-                                                    style={"textAlign": "center"}
-                                                )
-                                            ]
-                                        )
-                                    ],
-                                    className="mb-4",
-                                    style={"maxWidth": "540px", "border": "none"},
-                                    color="black",
-                                )
-                            ],
-                            xs=12, sm=12, md=6, lg=2, xl=2
-                        ),
-                        dbc.Col(
-                            [
-                                dbc.Card(
-                                    [
-                                        dbc.CardBody(
-                                            [
-                                                html.Div(
-                                                    [
-                                                        html.I(className="bi bi-heart-pulse-fill",
-                                                               style={"font-size": "2rem", "color": "#ffffff"}),
-                                                        html.P("Blood Pressure", className="card-text",
-                                                               style={"color": "#ffffff"}),
-                                                        html.P("120/80 mmHg", className="card-text",
-                                                               style={"color": "#3efb47"}),
-                                                    ],
-                                                    style={"textAlign": "center"}
-                                                )
-                                            ]
-                                        )
-                                    ],
-                                    className="mb-4",
-                                    style={"maxWidth": "540px", "border": "none"},
-                                    color="black",
-                                )
-                            ],
-                            xs=12, sm=12, md=6, lg=2, xl=2
-                        ),
-                        dbc.Col(
-                            [
-                                dbc.Card(
-                                    [
-                                        dbc.CardBody(
-                                            [
-                                                html.Div(
-                                                    [
-                                                        html.I(className="bi bi-activity",
-                                                               style={"font-size": "2rem", "color": "#ffffff"}),
-                                                        html.P("Electrocardiogram", className="card-text",
-                                                               style={"color": "#ffffff"}),
-                                                        html.P("AFIB", className="card-text",
-                                                               style={"color": "red"}),
-                                                    ],
-                                                    style={"textAlign": "center"}
-                                                )
-                                            ]
-                                        )
-                                    ],
-                                    className="mb-4",
-                                    style={"maxWidth": "540px", "border": "none"},
-                                    color="black",
-                                )
-                            ],
-                            xs=12, sm=12, md=6, lg=2, xl=2
-                        ),
-                        dbc.Col(
-                            [
-                                dbc.Card(
-                                    [
-                                        dbc.CardBody(
-                                            [
-                                                html.Div(
-                                                    [
-                                                        html.I(className="bi bi-lungs",
-                                                               style={"font-size": "2rem", "color": "#ffffff"}),
-                                                        html.P("Respiration Rate", className="card-text",
-                                                               style={"color": "#ffffff"}),
-                                                        html.P("15 Per minute", className="card-text",
-                                                               style={"color": "#3efb47"}),
-                                                    ],
-                                                    style={"textAlign": "center"}
-                                                )
-                                            ]
-                                        )
-                                    ],
-                                    className="mb-4",
-                                    style={"maxWidth": "540px", "border": "none"},
-                                    color="black",
-                                )
-                            ],
-                            xs=12, sm=12, md=6, lg=2, xl=2
-                        ),
-                    ], justify="around", className="g-3"),
-
-                ], style={'marginLeft': '50px'}, className="g-3"),
-            ], fluid=True),
+        html.H3('Past Measurements', style={"color": "#ffffff"}),
+        dcc.Graph(id='history-graph', figure=make_trend_figure(trend)) if trend else html.Div(),
+        dbc.ListGroup([
+            dbc.ListGroupItem([
+                html.Span(f"{datetime.fromtimestamp(m['started']):%Y-%m-%d %H:%M} - "
+                          f"{m['samples'] / (SAMPLE_RATE * CHANNELS):.0f} s"),
+                dbc.Button('Open', id={'type': 'open-recording', 'index': m['measurement_id']}, size='sm',
+                           color='primary', className='ms-3', style={"backgroundColor": "transparent"}),
+            ], color='dark')
+            for m in past
         ]),
-        html.Div(id='output-div-plots'),
-        dcc.Interval(
-            id='graph-interval-component',
-            interval=1000,
-            n_intervals=0
-        ),
-    ])
+    ], style={'marginLeft': '70px', 'marginRight': '70px'})
 
 
-#
-@app.callback(Output('output-div-plots', 'children'),
+def format_vital(value, unit, provisional=False):
+    if value is None:
+        return "--"
+    return f"{'~' if provisional else ''}{value:.0f}{unit}"
+
+
+def rhythm_display(capture):
+    rate = SAMPLE_RATE * CHANNELS
+    finished = capture.closed
+    # While recording, windows end on a hop so each is analysed once; a
+    # finished capture is analysed up to its last sample.
+    stop = capture.samples.count if finished else capture.samples.count // (RHYTHM_HOP * rate) * RHYTHM_HOP * rate
+    start = max(0, stop - RHYTHM_WINDOW * rate)
+    if stop - start < RHYTHM_MIN_WINDOW * rate:
+        return dash.no_update, dash.no_update
+    future = analysis_executor.submit("rhythm", capture, start, stop)
+    if finished:
+        concurrent.futures.wait([future], timeout=RHYTHM_WAIT)
+    if not future.done() or future.exception() is not None:
+        return dash.no_update, dash.no_update
+    rhythm = future.result()["rhythm"]
+    if rhythm is None:
+        # Too few beats for a verdict; say so rather than leave -- behind.
+        return ("Too few beats", {"color": "#ffffff"}) if finished else (dash.no_update, dash.no_update)
+    return rhythm, {"color": "red" if rhythm == "AFIB" else "#3efb47"}
+
+
+@app.callback(Output('heart-rate-value', 'children'),
+              Output('spo2-value', 'children'),
+              Output('respiration-rate-value', 'children'),
+              Output('rhythm-value', 'children'),
+              Output('rhythm-value', 'style'),
               Input('graph-interval-component', 'n_intervals'),
               State('stored-data', 'data'))
-def make_graphs(graph_interval, stored_rawdata):
-    if stored_rawdata is not None:
-        end_index = (graph_interval + 1) * 200
-        stored_raw_df = pd.DataFrame(stored_rawdata)
-
-        stop_index = 6000
-        start_index = max(0, end_index - 1000)
-
-        if end_index > stop_index:
-            end_index = stop_index
-            start_index = 0
-
-        trace_ppg = go.Scatter(
-            x=stored_raw_df.index[start_index:end_index],
-            y=stored_raw_df['Data'].iloc[start_index:end_index],
-            mode='lines',
-            name='PPG',
-            line=dict(color='blue')
-        )
-
-        fig = go.Figure(trace_ppg)
-        fig.update_layout(
-            height=500,
-            title=dict(
-                text='OPTICAL AND ELECTRICAL SIGNALS',
-                font=dict(color='#ffffff')
-            ),
-            xaxis_title=dict(
-                text='TimeStamp[Sec]',
-                font=dict(color='#ffffff')
-            ),
-            yaxis_title=dict(
-                text='Amplitude',
-                font=dict(color='#ffffff')
-            ),
-            xaxis=dict(
-                tickmode='array',
-                tickangle=-45,
-                tickfont=dict(size=10, color='white'),
-                showgrid=True,
-                gridcolor='rgba(128,128,128,0.2)',
-                gridwidth=1,
-                zeroline=False,
-                linecolor='rgb(204, 204, 204)',
-                linewidth=2
-            ),
-            yaxis=dict(
-                tickfont=dict(color='white'),
-                showgrid=True,
-                gridcolor='rgba(128,128,128,0.2)',
-                gridwidth=1,
-                zeroline=False,
-                linecolor='rgb(204, 204, 204)',
-                linewidth=2
-            ),
-            plot_bgcolor='black',
-            paper_bgcolor='black',
-            font=dict(color='white')
-        )
-        return dcc.Graph(figure=fig)
+def update_vital_signs(graph_interval, capture_handle):
+    capture = capture_store.get(session.get('session_id'), capture_handle)
+    if capture is None:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update
+    vital_signs = capture.vital_signs()
+    return (format_vital(vital_signs["heart_rate"], " BPM"),
+            format_vital(vital_signs["spo2"], "%") if CHANNELS == 2 else SPO2_UNAVAILABLE,
+            format_vital(vital_signs["respiration_rate"], " Per minute", vital_signs["respiration_provisional"]),
+            *rhythm_display(capture))
+
+
+def gap_status(capture):
+    gaps = capture.gaps()
+    if not gaps:
+        return dash.no_update
+    missing = sum(seconds for _, seconds in gaps)
+    return (f"Signal lost {len(gaps)} time{'s' if len(gaps) > 1 else ''} ({missing:.1f} s in total) "
+            f"while the wristband reconnected.")
 
-    empty_fig = go.Figure()
-    empty_fig.update_layout(
-        title=' ',
-        xaxis_title='TimeStamp[Sec]',
-        yaxis_title='Amplitude',
-        plot_bgcolor='black',
-        paper_bgcolor='black',
-        font=dict(color='white')
-    )
 
-    return dcc.Graph(figure=empty_fig)
+def patch_ppg_trace(x, y):
+    patch = dash.Patch()
+    patch['data'][0]['x'] = x.tolist()
+    patch['data'][0]['y'] = y.tolist()
+    return patch
+
+
+@app.callback(Output('ppg-graph', 'figure'),
+              Output('graph-cursor', 'data'),
+              Output('plot-status', 'children'),
+              Output('graph-interval-component', 'disabled'),
+              Input('graph-interval-component', 'n_intervals'),
+              Input('ppg-graph', 'relayoutData'),
+              State('graph-cursor', 'data'),
+              State('stored-data', 'data'),
+              State('plot-window', 'value'),
+              State('live-stream', 'data'))
+def make_graphs(graph_interval, relayout_data, view, capture_handle, window_seconds, live_stream):
+    session_id = session.get('session_id')
+    capture = capture_store.get(session_id, capture_handle)
+    if capture is None:
+        return dash.no_update, dash.no_update, dash.no_update, True
+
+    sample_buffer = capture.samples
+    finished = capture.closed
+    if finished and sample_buffer.count == 0:
+        result = ble.measurement_result(session_id, capture.measurement_id)
+        if result and result["status"] != "success":
+            return dash.no_update, dash.no_update, result["message"], True
+
+    view = view or {"live": True}
+    if dash.callback_context.triggered_id == 'ppg-graph':
+        relayout_data = relayout_data or {}
+        if 'xaxis.range[0]' in relayout_data:
+            x, y = capture.window(relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]'])
+            view = {"live": False}
+        elif relayout_data.get('xaxis.autorange') and finished:
+            x, y = capture.window()
+            view = {"live": False}
+        elif relayout_data.get('xaxis.autorange'):
+            x, y = capture.window(sample_buffer.count - (window_seconds or 1) * SAMPLE_RATE * CHANNELS)
+            view = {"live": True}
+        else:
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        return patch_ppg_trace(x, y), view, dash.no_update, finished and not view["live"]
+
+    # Live samples are pushed by the /stream endpoint; the interval only
+    # swaps in the whole-capture overview once the measurement has ended,
+    # or redraws the live window for a viewer the endpoint turned away.
+    if view["live"] and not finished and (live_stream or {}).get("polling"):
+        x, y = capture.window(sample_buffer.count - (window_seconds or 1) * SAMPLE_RATE * CHANNELS)
+        return patch_ppg_trace(x, y), dash.no_update, gap_status(capture), False
+    if view["live"] and finished:
+        x, y = capture.window()
+        result = ble.measurement_result(session_id, capture.measurement_id)
+        status = result["message"] if result and result["status"] != "success" else gap_status(capture)
+        return patch_ppg_trace(x, y), {"live": False}, status, True
+    return dash.no_update, dash.no_update, gap_status(capture), finished
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='ppg', function_name='stream'),
+    Output('live-stream', 'data'),
+    Input('stored-data', 'data'),
+    Input('plot-window', 'value'),
+    Input('graph-interval-component', 'n_intervals'),
+    State('live-stream', 'data')
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='ppg', function_name='toggleReplay'),
+    Output('replay', 'data'),
+    Input('replay-button', 'n_clicks'),
+    State('stored-data', 'data'),
+    State('replay', 'data'),
+    prevent_initial_call=True
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='ppg', function_name='replayTick'),
+    Output('ppg-graph', 'figure', allow_duplicate=True),
+    Output('replay', 'data', allow_duplicate=True),
+    Input('replay-interval', 'n_intervals'),
+    State('replay-speed', 'value'),
+    State('plot-window', 'value'),
+    State('replay', 'data'),
+    State('ppg-graph', 'figure'),
+    prevent_initial_call=True
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='ppg', function_name='replayControls'),
+    Output('replay-interval', 'disabled'),
+    Output('replay-button', 'children'),
+    Input('replay', 'data')
+)
+
+
+stream_slots = threading.BoundedSemaphore(STREAM_LIMIT)
+
+
+def stream_samples(capture, cursor):
+    # A viewer that cannot keep up skips to the newest plot window rather
+    # than slowing the acquisition down.
+    subscription = Subscription(capture.samples, cursor, max_lag=PLOT_WINDOW)
+    while True:
+        capture.wait(subscription.cursor, STREAM_KEEPALIVE)
+        dropped = subscription.dropped
+        first, samples = subscription.read(PLOT_WINDOW)
+        if subscription.dropped > dropped:
+            STREAM_DROPPED_SAMPLES.inc(subscription.dropped - dropped)
+        if len(samples):
+            batch = json.dumps({'start': first, 'y': samples.tolist()})
+            yield f"id: {subscription.cursor}\ndata: {batch}\n\n"
+        elif capture.closed:
+            yield "event: end\ndata: {}\n\n"
+            return
+        else:
+            yield ": keepalive\n\n"
+
+
+@server.route('/samples/<measurement_id>')
+def samples(measurement_id):
+    capture = capture_store.get(session.get('session_id'), {"measurement_id": measurement_id})
+    if capture is None:
+        flask.abort(404)
+    # One page per request, from ?start= on; X-Sample-Count says where the capture ends.
+    count = capture.samples.count
+    start = max(capture.samples.first_index, flask.request.args.get('start', 0, type=int))
+    first, data = capture.samples.read(start, min(count, start + SAMPLES_PAGE))
+    return flask.Response(data.astype('<u2').tobytes(), mimetype='application/octet-stream',
+                          headers={'X-First-Sample': str(first), 'X-Sample-Count': str(count)})
+
+
+@server.route('/stream/<measurement_id>')
+def stream(measurement_id):
+    capture = capture_store.get(session.get('session_id'), {"measurement_id": measurement_id})
+    if capture is None:
+        flask.abort(404)
+    if not stream_slots.acquire(blocking=False):
+        STREAM_REJECTED.inc()
+        return flask.Response(status=503, headers={'Retry-After': str(STREAM_KEEPALIVE)})
+    # A reconnecting EventSource resumes after the last batch it received.
+    cursor = flask.request.headers.get('Last-Event-ID', 0, type=int)
+    response = flask.Response(stream_samples(capture, cursor), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(stream_slots.release)
+    return response
+
+
+def export_time(name):
+    # Epoch seconds or an ISO 8601 timestamp.
+    value = flask.request.args.get(name)
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            flask.abort(400, f"{name} must be epoch seconds or an ISO 8601 time")
+    if not math.isfinite(seconds):
+        flask.abort(400, f"{name} must be a finite time")
+    return seconds
+
+
+export_slots = threading.BoundedSemaphore(EXPORT_LIMIT)
+
+
+@server.route('/export/<patient_id>')
+def export(patient_id):
+    """Stream a patient's recordings in ``[since, until)`` as csv, parquet or raw.
+
+    Everything is read from the recordings a chunk at a time, so a worker's
+    memory stays flat however much is exported. At most ``EXPORT_LIMIT``
+    run at once.
+    """
+    if not export_slots.acquire(blocking=False):
+        EXPORT_REJECTED.inc()
+        return flask.Response(status=503, headers={'Retry-After': str(EXPORT_RETRY)})
+    try:
+        response = export_response(patient_id)
+    except BaseException:
+        export_slots.release()
+        raise
+    response.call_on_close(export_slots.release)
+    return response
+
+
+def export_response(patient_id):
+    export_format = flask.request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        flask.abort(400, f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    since, until = export_time('since'), export_time('until')
+    wanted = set(flask.request.args.getlist('measurement'))
+    selections = []
+    for measurement in patient_store.recorded_between(patient_id, since, until):
+        if wanted and measurement['measurement_id'] not in wanted:
+            continue
+        if not measurement['path']:
+            continue
+        try:
+            recording = CaptureFile(measurement['path'])
+            start, stop = sample_range(recording, since, until)
+        except (OSError, ValueError):
+            # A missing or damaged recording leaves the rest of the export intact.
+            continue
+        if start < stop:
+            selections.append((recording, start, stop))
+    if not selections:
+        flask.abort(404)
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    name = selections[0][0].measurement_id if len(selections) == 1 else secure_filename(patient_id) or 'export'
+    headers = {'Content-Disposition': f'attachment; filename="{name}.{extension}"', 'Cache-Control': 'no-store',
+               'X-Accel-Buffering': 'no'}
+    if export_format == 'raw':
+        if len(selections) != 1:
+            flask.abort(400, "raw exports one measurement, pick it with measurement=<id>")
+        recording, start, stop = selections[0]
+        start, stop = 2 * start, 2 * stop
+        length = stop - start
+        headers.update({'Accept-Ranges': 'bytes', 'X-First-Sample': str(start // 2),
+                        'X-Sample-Rate': str(recording.sample_rate), 'X-Channels': str(recording.channels)})
+        status = 200
+        byte_range = flask.request.range
+        if byte_range is not None and len(byte_range.ranges) == 1:
+            requested = byte_range.range_for_length(length)
+            if requested is None:
+                return flask.Response(status=416, headers={'Content-Range': f'bytes */{length}'})
+            status = 206
+            headers['Content-Range'] = f'bytes {requested[0]}-{requested[1] - 1}/{length}'
+            start, stop = start + requested[0], start + requested[1]
+        headers['Content-Length'] = str(stop - start)
+        return flask.Response(raw_chunks(recording, start, stop), status=status, mimetype=mimetype,
+                              headers=headers)
+
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            flask.abort(501, "parquet export needs pyarrow installed")
+        return flask.Response(parquet_chunks(selections), mimetype=mimetype, headers=headers)
+
+    chunks = csv_chunks(selections)
+    headers['Vary'] = 'Accept-Encoding'
+    if 'gzip' in flask.request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return flask.Response(chunks, mimetype=mimetype, headers=headers)
+
+
+def is_callback_request():
+    return flask.request.path == app.config.routes_pathname_prefix + '_dash-update-component'
+
+
+@server.before_request
+def start_callback_timer():
+    if is_callback_request():
+        flask.g.callback_started = time.perf_counter()
+
+
+@server.after_request
+def observe_callback(response):
+    started = flask.g.pop('callback_started', None)
+    if started is not None:
+        body = flask.request.get_json(silent=True) or {}
+        callback = app.callback_map.get(body.get('output'), {}).get('callback')
+        CALLBACK_SECONDS.labels(getattr(callback, '__name__', 'unknown')).observe(time.perf_counter() - started)
+    return response
+
+
+@server.route('/metrics')
+def metrics():
+    text = REGISTRY.render()
+    if REMOTE_BLE:
+        # The BLE links, and so their metrics, live in the gateway process.
+        try:
+            text += ble.metrics()
+        except (GatewayError, OSError):
+            pass
+    return flask.Response(text, content_type=CONTENT_TYPE)
 
 
 if __name__ == '__main__':
-    app.run_server(debug=False, host='0.0.0.0', port=8000)
+    if SERVE_GATEWAY:
+        serve_gateway(GATEWAY_SOCKET or "ble-gateway.sock")
+    else:
+        app.run_server(debug=False, host='0.0.0.0', port=8000)
@@ -0,0 +1,96 @@
+import threading
+
+import numpy as np
+
+BASE_BUCKET = 8
+UPDATE_CHUNK = 2 ** 20
+LEVEL_FACTOR = 4
+DISPLAY_POINTS = 2000
+
+
+class MinMaxLevel:
+    def __init__(self, bucket_size, dtype):
+        self.bucket_size = bucket_size
+        self.mins = np.empty(1024, dtype=dtype)
+        self.maxs = np.empty(1024, dtype=dtype)
+        self.size = 0
+
+    def append(self, mins, maxs):
+        end = self.size + len(mins)
+        if end > len(self.mins):
+            capacity = max(end, 2 * len(self.mins))
+            self.mins = np.resize(self.mins, capacity)
+            self.maxs = np.resize(self.maxs, capacity)
+        self.mins[self.size:end] = mins
+        self.maxs[self.size:end] = maxs
+        self.size = end
+
+
+class MinMaxPyramid:
+    """Multi-resolution min/max summary of a capture.
+
+    Level 0 holds the min and max of every ``BASE_BUCKET`` samples and each
+    following level merges ``LEVEL_FACTOR`` buckets of the one below, so a
+    query picks the finest level that fits the requested number of points
+    and costs O(points) whatever the capture length. The pyramid pulls new
+    samples from a SampleBuffer lazily, before they can be overwritten.
+    """
+
+    def __init__(self, dtype=np.uint16):
+        self.dtype = dtype
+        self.levels = [MinMaxLevel(BASE_BUCKET, dtype)]
+        self.pending = np.empty(0, dtype=dtype)
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def update(self, sample_buffer):
+        with self.lock:
+            while True:
+                samples, self.cursor = sample_buffer.read_since(self.cursor, UPDATE_CHUNK)
+                if len(samples) == 0:
+                    break
+                self._append(samples)
+
+    def _append(self, samples):
+        data = np.concatenate((self.pending, samples))
+        full = len(data) - len(data) % BASE_BUCKET
+        self.pending = data[full:].copy()
+        if full == 0:
+            return
+        blocks = data[:full].reshape(-1, BASE_BUCKET)
+        self.levels[0].append(blocks.min(axis=1), blocks.max(axis=1))
+
+        index = 0
+        while self.levels[index].size >= LEVEL_FACTOR:
+            level = self.levels[index]
+            if index + 1 == len(self.levels):
+                self.levels.append(MinMaxLevel(level.bucket_size * LEVEL_FACTOR, self.dtype))
+            parent = self.levels[index + 1]
+            start = parent.size * LEVEL_FACTOR
+            end = level.size - level.size % LEVEL_FACTOR
+            if end > start:
+                parent.append(level.mins[start:end].reshape(-1, LEVEL_FACTOR).min(axis=1),
+                              level.maxs[start:end].reshape(-1, LEVEL_FACTOR).max(axis=1))
+            index += 1
+
+    def window(self, sample_buffer, start=0, stop=None, points=DISPLAY_POINTS):
+        self.update(sample_buffer)
+        stop = sample_buffer.count if stop is None else min(int(stop), sample_buffer.count)
+        start = max(0, int(start))
+        if stop - start <= points and start >= sample_buffer.first_index:
+            first, samples = sample_buffer.read(start, stop)
+            return np.arange(first, first + len(samples)), samples
+
+        with self.lock:
+            for level in self.levels:
+                first = start // level.bucket_size
+                last = min(-(-stop // level.bucket_size), level.size)
+                if 2 * (last - first) <= points:
+                    break
+            size = max(0, last - first)
+            x = np.repeat(np.arange(first, first + size) * level.bucket_size, 2)
+            x[1::2] += level.bucket_size // 2
+            y = np.empty(2 * size, dtype=self.dtype)
+            y[0::2] = level.mins[first:first + size]
+            y[1::2] = level.maxs[first:first + size]
+        return x, y
@@ -0,0 +1,127 @@
+import io
+import zlib
+
+import numpy as np
+
+EXPORT_CHUNK = 2 ** 16
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "raw": ("application/octet-stream", "u16le"),
+}
+CSV_HEADER = b"measurement_id,sample,time,value\n"
+# Compression runs inline with the download, so favour speed: level 1 is
+# about four times faster than 6 on PPG CSV for a ~20% larger body.
+GZIP_LEVEL = 1
+PARQUET_COMPRESSION = "zstd"
+
+
+def sample_range(recording, since=None, until=None):
+    """``[start, stop)`` sample indices of ``recording`` recorded in ``[since, until)``."""
+    start = 0 if since is None else recording.sample_at(since)
+    stop = recording.count if until is None else recording.sample_at(until)
+    return start, max(start, stop)
+
+
+def sample_chunks(recording, start, stop, chunk=EXPORT_CHUNK):
+    # Slices of the memory map, so only one chunk is ever copied out of the
+    # page cache regardless of how long the recording is.
+    samples = recording.samples()
+    for first in range(start, min(stop, len(samples)), chunk):
+        last = min(stop, first + chunk)
+        yield first, recording.times(first, last), samples[first:last]
+
+
+def ascii_digits(column):
+    """ASCII digits of non-negative integers, one row each, and a mask without the leading zeros."""
+    width = len(str(int(column.max()))) if len(column) else 1
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    significant = column[:, None] >= powers
+    significant[:, -1] = True
+    return (column[:, None] // powers % 10 + ord("0")).astype(np.uint8), significant
+
+
+def ascii_text(text, rows):
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+    return np.broadcast_to(data, (rows, len(data))), np.ones((rows, len(data)), dtype=bool)
+
+
+def csv_rows(prefix, first, times, values):
+    # Built a column at a time as a byte matrix, about twice as fast as
+    # formatting each row.
+    rows = len(values)
+    seconds, millis = np.divmod(np.round(np.asarray(times) * 1000).astype(np.int64), 1000)
+    millis = ascii_digits(millis + 1000)[0][:, 1:], np.ones((rows, 3), dtype=bool)
+    columns = [ascii_text(prefix, rows), ascii_digits(np.arange(first, first + rows, dtype=np.int64)),
+               ascii_text(",", rows), ascii_digits(seconds), ascii_text(".", rows), millis, ascii_text(",", rows),
+               ascii_digits(np.asarray(values, dtype=np.int64)), ascii_text("\n", rows)]
+    text = np.hstack([digits for digits, _ in columns])
+    return text[np.hstack([significant for _, significant in columns])].tobytes()
+
+
+def csv_chunks(selections):
+    yield CSV_HEADER
+    for recording, start, stop in selections:
+        for first, times, values in sample_chunks(recording, start, stop):
+            yield csv_rows(recording.measurement_id + ",", first, times, values)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def raw_chunks(recording, start, stop):
+    """Bytes ``[start, stop)`` of the recording's little-endian uint16 body."""
+    body = recording.samples().view(np.uint8)
+    for offset in range(start, min(stop, len(body)), EXPORT_CHUNK * 2):
+        yield body[offset:min(stop, offset + EXPORT_CHUNK * 2)].tobytes()
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that keeps what was written until ``drain``."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def parquet_chunks(selections):
+    # pyarrow is optional and only needed here.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("measurement_id", pa.dictionary(pa.int32(), pa.string())), ("sample", pa.int64()),
+                        ("time", pa.float64()), ("value", pa.uint16())])
+    sink = ChunkSink()
+    # Each chunk becomes one row group, handed on as soon as it is written.
+    with pq.ParquetWriter(sink, schema, compression=PARQUET_COMPRESSION) as writer:
+        for recording, start, stop in selections:
+            for first, times, values in sample_chunks(recording, start, stop):
+                measurement_ids = pa.DictionaryArray.from_arrays(np.zeros(len(values), dtype=np.int32),
+                                                                 [recording.measurement_id])
+                writer.write_table(pa.table([measurement_ids, np.arange(first, first + len(values)), times,
+                                             np.asarray(values, dtype=np.uint16)], schema=schema))
+                yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import json
+import os
+import socket
+import threading
+
+GATEWAY_TIMEOUT = 60
+
+
+class GatewayError(Exception):
+    pass
+
+
+class GatewayServer:
+    """Serves BLE operations to web workers over a Unix socket.
+
+    Runs on the gateway's BLE event loop. Each request is one JSON line
+    ``{"op": name, "args": [...]}`` answered by ``{"result": ...}`` or
+    ``{"error": message}``. Handlers must not block the loop: they either
+    return at once or are coroutines.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.server = None
+
+    async def start(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self.handle, path=path)
+        os.chmod(path, 0o660)
+        return self.server
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    result = self.handlers[request["op"]](*request.get("args", []))
+                    if asyncio.iscoroutine(result):
+                        result = await result
+                    response = {"result": result}
+                except Exception as e:
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class GatewayClient:
+    """Blocking client of a GatewayServer; ``client.op(*args)`` runs ``op``
+    in the gateway. Each thread keeps its own socket connection."""
+
+    def __init__(self, path, timeout=GATEWAY_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def stream(self):
+        stream = getattr(self.local, "stream", None)
+        if stream is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            stream = self.local.stream = sock.makefile("rwb")
+        return stream
+
+    def call(self, op, *args):
+        request = json.dumps({"op": op, "args": args}).encode() + b"\n"
+        for attempt in range(2):
+            try:
+                stream = self.stream()
+                stream.write(request)
+                stream.flush()
+                line = stream.readline()
+                if line:
+                    break
+            except OSError:
+                if attempt:
+                    raise
+            # The gateway restarted or dropped this connection; reconnect once.
+            self.local.stream = None
+        else:
+            raise GatewayError(f"BLE gateway at {self.path} closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise GatewayError(response["error"])
+        return response["result"]
+
+    def __getattr__(self, op):
+        if op.startswith("_"):
+            raise AttributeError(op)
+        return functools.partial(self.call, op)
@@ -0,0 +1,155 @@
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            for suffix, extra, value in child.samples():
+                yield self.name + suffix, format_labels(self.labelnames, values, extra), value
+
+    def render(self):
+        samples = [f"{name}{labels} {format_value(value)}" for name, labels, value in self.samples()]
+        if not samples:
+            return ""
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + samples)
+
+
+class Counter(Metric):
+    """Monotonic count; name it with the ``_total`` suffix."""
+
+    kind = "counter"
+
+    class Child:
+        def __init__(self):
+            self.value = 0
+
+        def inc(self, amount=1):
+            self.value += amount
+
+        def samples(self):
+            yield "", (), self.value
+
+    def new_child(self):
+        return Counter.Child()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram in the Prometheus text format.
+
+    ``observe`` is a bisect and three adds with no allocation, cheap enough
+    for the per-notification path. Each bucket count is kept
+    non-cumulative and summed when scraped. Children take no lock, so two
+    threads observing at the same instant can lose an increment, which a
+    latency distribution can afford.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    class Child:
+        def __init__(self, buckets):
+            self.buckets = buckets
+            self.counts = [0] * (len(buckets) + 1)
+            self.sum = 0.0
+            self.count = 0
+
+        def observe(self, value):
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+        def samples(self):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+                cumulative += count
+                yield "_bucket", (("le", format_value(float(bound))),), cumulative
+            yield "_sum", (), self.sum
+            yield "_count", (), self.count
+
+    def new_child(self):
+        return Histogram.Child(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Gauge(Metric):
+    """Point-in-time values read by ``collect`` at scrape time, so the
+    measured code pays nothing. ``collect`` returns ``{label_values: value}``."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, collect, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for values, value in self.collect().items():
+            yield self.name, format_labels(self.labelnames, values), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics.setdefault(metric.name, metric)
+        return self.metrics[metric.name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, collect, labelnames=()):
+        return self.register(Gauge(name, documentation, collect, labelnames))
+
+    def render(self):
+        # Families without samples are left out, so the gateway's and a web
+        # worker's output can be concatenated without repeating a family.
+        return "".join(text + "\n" for text in (metric.render() for metric in self.metrics.values()) if text)
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+
+DATABASE_PATH = os.environ.get("PATIENT_DATABASE", "patients.db")
+PAGE_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    patient_id TEXT PRIMARY KEY,
+    device_address TEXT
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    measurement_id TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL REFERENCES patients (patient_id),
+    started REAL NOT NULL,
+    path TEXT,
+    samples INTEGER NOT NULL DEFAULT 0,
+    ended REAL
+);
+CREATE INDEX IF NOT EXISTS measurements_patient_started ON measurements (patient_id, started);
+CREATE TABLE IF NOT EXISTS aggregates (
+    measurement_id TEXT NOT NULL REFERENCES measurements (measurement_id),
+    patient_id TEXT NOT NULL,
+    window_start REAL NOT NULL,
+    heart_rate_mean REAL,
+    heart_rate_min REAL,
+    heart_rate_max REAL,
+    spo2 REAL,
+    respiration_rate REAL,
+    PRIMARY KEY (measurement_id, window_start)
+);
+CREATE INDEX IF NOT EXISTS aggregates_patient_window ON aggregates (patient_id, window_start);
+"""
+
+
+class PatientStore:
+    """Patients, their measurements and per-window vital-sign aggregates.
+
+    Each thread gets its own SQLite connection. Measurements point at their
+    raw recording and every lookup goes through a (patient_id, time) index,
+    so a multi-week trend reads a few hundred aggregate rows.
+    """
+
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+            # Databases created before measurements had an end time.
+            if "ended" not in {row[1] for row in connection.execute("PRAGMA table_info(measurements)")}:
+                connection.execute("ALTER TABLE measurements ADD COLUMN ended REAL")
+            connection.execute("CREATE INDEX IF NOT EXISTS measurements_patient_ended "
+                               "ON measurements (patient_id, ended)")
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def add_patient(self, patient_id, device_address=None):
+        # Adding a known patient keeps their wristband unless a new one is given.
+        with self.connection() as connection:
+            connection.execute("INSERT INTO patients (patient_id, device_address) VALUES (?, ?) "
+                               "ON CONFLICT (patient_id) DO UPDATE SET "
+                               "device_address = COALESCE(excluded.device_address, device_address)",
+                               (patient_id, device_address and device_address.upper()))
+
+    def device_for(self, patient_id):
+        row = self.connection().execute("SELECT device_address FROM patients WHERE patient_id = ?",
+                                        (patient_id,)).fetchone()
+        return row[0] if row else None
+
+    def search_patients(self, prefix=None, offset=0, limit=PAGE_SIZE):
+        rows = self.connection().execute(
+            "SELECT patient_id FROM patients WHERE patient_id LIKE ? ORDER BY patient_id LIMIT ? OFFSET ?",
+            ((prefix or "") + "%", limit, offset))
+        return [row[0] for row in rows]
+
+    def add_measurement(self, measurement_id, patient_id, started, path):
+        with self.connection() as connection:
+            connection.execute("INSERT OR IGNORE INTO patients (patient_id) VALUES (?)", (patient_id,))
+            connection.execute("INSERT INTO measurements (measurement_id, patient_id, started, path) "
+                               "VALUES (?, ?, ?, ?)", (measurement_id, patient_id, started, path))
+
+    def finish_measurement(self, measurement_id, samples, ended):
+        with self.connection() as connection:
+            connection.execute("UPDATE measurements SET samples = ?, ended = ? WHERE measurement_id = ?",
+                               (samples, ended, measurement_id))
+
+    def add_aggregates(self, measurement_id, patient_id, rows):
+        with self.connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO aggregates (measurement_id, patient_id, window_start, heart_rate_mean, "
+                "heart_rate_min, heart_rate_max, spo2, respiration_rate) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(measurement_id, patient_id, *row) for row in rows])
+
+    def measurements(self, patient_id, since=None, until=None, offset=0, limit=PAGE_SIZE):
+        rows = self.connection().execute(
+            "SELECT measurement_id, started, path, samples FROM measurements "
+            "WHERE patient_id = ? AND started >= ? AND started < ? ORDER BY started DESC LIMIT ? OFFSET ?",
+            (patient_id, since or 0, until or float("inf"), limit, offset))
+        return [dict(zip(("measurement_id", "started", "path", "samples"), row)) for row in rows]
+
+    def recorded_between(self, patient_id, since=None, until=None):
+        """Measurements with samples in ``[since, until)``, oldest first.
+
+        Unfinished measurements have no end time yet and are always included.
+        """
+        # Both halves are ranges on the (patient_id, ended) index, rather than
+        # a walk through the patient's whole history by start time.
+        rows = self.connection().execute(
+            "SELECT measurement_id, started, path, samples "
+            "FROM measurements INDEXED BY measurements_patient_ended "
+            "WHERE patient_id = ? AND ended >= ? AND started < ? "
+            "UNION ALL SELECT measurement_id, started, path, samples "
+            "FROM measurements INDEXED BY measurements_patient_ended "
+            "WHERE patient_id = ? AND ended IS NULL AND started < ? ORDER BY started",
+            (patient_id, since or 0, until or float("inf"), patient_id, until or float("inf")))
+        return [dict(zip(("measurement_id", "started", "path", "samples"), row)) for row in rows]
+
+    def measurement(self, measurement_id):
+        row = self.connection().execute(
+            "SELECT measurement_id, patient_id, started, path, samples FROM measurements WHERE measurement_id = ?",
+            (measurement_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("measurement_id", "patient_id", "started", "path", "samples"), row))
+
+    def recording_path(self, measurement_id):
+        measurement = self.measurement(measurement_id)
+        return measurement["path"] if measurement else None
+
+    def trend(self, patient_id, since=None, until=None):
+        rows = self.connection().execute(
+            "SELECT window_start, heart_rate_mean, heart_rate_min, heart_rate_max, spo2, respiration_rate "
+            "FROM aggregates WHERE patient_id = ? AND window_start >= ? AND window_start < ? "
+            "ORDER BY window_start",
+            (patient_id, since or 0, until or float("inf")))
+        columns = ("window_start", "heart_rate_mean", "heart_rate_min", "heart_rate_max", "spo2",
+                   "respiration_rate")
+        return {column: list(values) for column, values in zip(columns, zip(*rows))} if rows else {}
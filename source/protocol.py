@@ -0,0 +1,66 @@
+import asyncio
+import os
+import time
+
+service_uuid = "fe8a042a-c4e3-11ea-87d0-0242ac130003"
+characteristics_uuid = "fe8a0438-c4e3-11ea-87d0-0242ac130003"
+
+heart_rate_commands = [0x806400, 0x80710403000000, 0xc070010101, 0xc0700203000000, 0xc070030100,
+                       0xc07005020000, 0x80720100, 0xc072020a00000000000000000000,
+                       0xc072030c000000000000000000000000,
+                       0xc072052c0000000000000000000000000000000000000000000000000000000000000000010000000000000000000000,
+                       0xc072045c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000,
+                       0x807604a0860100,
+                       0x806617000700073f000000000402040003101004000310101010,
+                       0x80660701000048000000,
+                       0x80661a0257000000000009000000000000001500010000000000000000,
+                       0x8066170300020000000000000000000000000000000000000000,
+                       0x8066170400000000000000000000000000000000000000000000,
+                       0x80660a05000000a76403075707,
+                       0x80661606000000000000000000000000000000000000000000,
+                       0x80660c070303000000000000000000,
+                       0x80667b0800000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000,
+                       0x80661e090700000a9f0001000000000000000000004f0000000000000000010000,
+                       0x8066060a0000000000, 0x8066030b0000,
+                       0x806814000101051e0519320600000090d00300d0bf0b00,
+                       0x806c00, 0x806900, 0x807700, 0x806e00]
+
+turn_off_led_command = b'\x80o\x00'
+heart_rate_command_bytes = [x.to_bytes((x.bit_length() + 7) // 8, 'big') for x in heart_rate_commands]
+
+# "response" always waits for the device's write response, "no-response" never does and
+# "auto" skips it whenever the characteristic advertises write-without-response.
+# Waiting is the default until a wristband is known to keep up without it.
+COMMAND_WRITE_MODE = os.environ.get("BLE_COMMAND_WRITE_MODE", "response")
+# Pause after each write-without-response so a burst of commands is spread over
+# connection events instead of overrunning the controller's queue.
+COMMAND_INTERVAL = 0.0075
+ATT_HEADER_SIZE = 3
+
+
+def max_write_without_response_size(client, characteristic):
+    size = getattr(characteristic, "max_write_without_response_size", None)
+    if size:
+        return size
+    return getattr(client, "mtu_size", 23) - ATT_HEADER_SIZE
+
+
+def use_write_without_response(characteristic, write_mode=None):
+    write_mode = write_mode or COMMAND_WRITE_MODE
+    if write_mode == "no-response":
+        return True
+    return write_mode == "auto" and "write-without-response" in characteristic.properties
+
+
+async def write_commands(client, characteristic, commands, write_mode=None):
+    without_response = use_write_without_response(characteristic, write_mode)
+    max_size = max_write_without_response_size(client, characteristic)
+    timings = []
+    for command in commands:
+        response = not without_response or len(command) > max_size
+        started = time.perf_counter()
+        await client.write_gatt_char(characteristic.uuid, command, response=response)
+        timings.append((command, time.perf_counter() - started))
+        if not response:
+            await asyncio.sleep(COMMAND_INTERVAL)
+    return timings
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from protocol import characteristics_uuid, heart_rate_command_bytes, service_uuid, turn_off_led_command
+from vitals import CHANNELS
+
+SIMULATED_DEVICES = int(os.environ.get("SIMULATED_DEVICES", "1"))
+SIMULATED_SAMPLE_RATE = int(os.environ.get("SIMULATED_SAMPLE_RATE", "200"))
+SIMULATED_PAYLOAD_SIZE = int(os.environ.get("SIMULATED_PAYLOAD_SIZE", "244"))
+ADDRESS_PREFIX = "5E:A1:00"
+ADVERTISING_INTERVAL = 1.0
+CONNECT_LATENCY = 0.05
+WRITE_RESPONSE_LATENCY = 0.0075
+MTU_SIZE = 247
+
+
+def simulated_address(index):
+    return f"{ADDRESS_PREFIX}:{index >> 16 & 0xff:02X}:{index >> 8 & 0xff:02X}:{index & 0xff:02X}"
+
+
+class SimulatedCharacteristic:
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.properties = ["read", "write", "write-without-response", "notify"]
+        self.max_write_without_response_size = MTU_SIZE - 3
+
+
+class SimulatedService:
+    def __init__(self, uuid, characteristic):
+        self.uuid = uuid
+        self.characteristics = [characteristic]
+
+
+class SimulatedDevice:
+    def __init__(self, address):
+        self.address = address
+        self.name = f"Simulated wristband {address}"
+        self.details = None
+
+
+class SimulatedWristband:
+    """Synthetic PPG source with the real wristband's GATT behaviour.
+
+    Notifications start once the full ``heart_rate_commands`` handshake has
+    been written in order and stop on ``turn_off_led_command``. Each one
+    carries ``payload_size`` bytes of big-endian uint16 samples, paced to
+    ``sample_rate`` samples per second per channel.
+    """
+
+    def __init__(self, address, sample_rate=SIMULATED_SAMPLE_RATE, payload_size=SIMULATED_PAYLOAD_SIZE,
+                 channels=CHANNELS, seed=0):
+        rng = np.random.default_rng(seed)
+        self.device = SimulatedDevice(address)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames_per_payload = max(1, payload_size // (2 * channels))
+        self.heart_rate = rng.uniform(55, 100)
+        self.respiration_rate = rng.uniform(12, 18)
+        self.noise = rng
+        self.frame = 0
+        self.handshake = 0
+        self.notify = None
+        self.stream_task = None
+        self.client = None
+        self.reachable_at = 0.0
+
+    @property
+    def streaming(self):
+        return self.stream_task is not None and not self.stream_task.done()
+
+    def receive(self, command):
+        if command == turn_off_led_command:
+            self.stop()
+        elif command == heart_rate_command_bytes[self.handshake]:
+            self.handshake += 1
+            if self.handshake == len(heart_rate_command_bytes):
+                self.handshake = 0
+                self.start()
+        else:
+            self.handshake = int(command == heart_rate_command_bytes[0])
+
+    def start(self):
+        if not self.streaming:
+            self.stream_task = asyncio.ensure_future(self.stream())
+
+    def stop(self):
+        if self.streaming:
+            self.stream_task.cancel()
+        self.stream_task = None
+
+    def payload(self):
+        t = (self.frame + np.arange(self.frames_per_payload)) / self.sample_rate
+        self.frame += self.frames_per_payload
+        pulse = np.maximum(0, np.sin(2 * np.pi * self.heart_rate / 60 * t)) ** 3
+        baseline = 30000 + 800 * np.sin(2 * np.pi * self.respiration_rate / 60 * t)
+        infrared = baseline + 1500 * pulse + self.noise.normal(0, 50, len(t))
+        if self.channels == 2:
+            red = 0.8 * baseline + 600 * pulse + self.noise.normal(0, 50, len(t))
+            frames = np.column_stack((red, infrared))
+        else:
+            frames = infrared
+        return bytearray(frames.astype(">u2").tobytes())
+
+    async def stream(self):
+        interval = self.frames_per_payload / self.sample_rate
+        started = time.perf_counter()
+        sent = 0
+        while True:
+            sent += 1
+            # Pace against the start time so sleep jitter does not accumulate.
+            await asyncio.sleep(max(0.0, started + sent * interval - time.perf_counter()))
+            if self.notify is not None:
+                self.notify(characteristics_uuid, self.payload())
+
+
+class SimulatedClient:
+    def __init__(self, wristband, disconnected_callback=None):
+        self.wristband = wristband
+        self.address = wristband.device.address
+        self.mtu_size = MTU_SIZE
+        self.is_connected = False
+        self.disconnected_callback = disconnected_callback
+        self.loop = None
+        self.characteristic = SimulatedCharacteristic(characteristics_uuid)
+
+    async def connect(self):
+        await asyncio.sleep(CONNECT_LATENCY)
+        if time.monotonic() < self.wristband.reachable_at:
+            raise ConnectionError(f"{self.address} did not respond")
+        self.is_connected = True
+        self.loop = asyncio.get_running_loop()
+        self.wristband.client = self
+        return True
+
+    async def disconnect(self):
+        self.drop()
+        return True
+
+    def drop(self):
+        # The wristband forgets the session: the next link starts with a new handshake.
+        self.wristband.stop()
+        self.wristband.notify = None
+        self.wristband.handshake = 0
+        was_connected, self.is_connected = self.is_connected, False
+        if was_connected and self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def get_services(self):
+        return [SimulatedService(service_uuid, self.characteristic)]
+
+    async def start_notify(self, characteristic, callback):
+        self.wristband.notify = callback
+
+    async def stop_notify(self, characteristic):
+        self.wristband.notify = None
+
+    async def write_gatt_char(self, characteristic, data, response=False):
+        if not self.is_connected:
+            raise ConnectionError(f"{self.address} is not connected")
+        if response:
+            await asyncio.sleep(WRITE_RESPONSE_LATENCY)
+        self.wristband.receive(bytes(data))
+
+
+class SimulatedScanner:
+    def __init__(self, transport, detection_callback):
+        self.transport = transport
+        self.detection_callback = detection_callback
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.ensure_future(self.advertise())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def advertise(self):
+        while True:
+            for wristband in self.transport.wristbands.values():
+                self.detection_callback(wristband.device, None)
+            await asyncio.sleep(ADVERTISING_INTERVAL)
+
+
+class SimulatedTransport:
+    """In-process stand-in for the BLE stack, see ConnectionManager."""
+
+    def __init__(self, count=SIMULATED_DEVICES, sample_rate=SIMULATED_SAMPLE_RATE,
+                 payload_size=SIMULATED_PAYLOAD_SIZE, addresses=()):
+        addresses = [address.upper() for address in addresses][:count]
+        addresses += [simulated_address(index) for index in range(len(addresses), count)]
+        self.wristbands = {address: SimulatedWristband(address, sample_rate, payload_size, seed=index)
+                           for index, address in enumerate(addresses)}
+
+    @property
+    def addresses(self):
+        return list(self.wristbands)
+
+    def scanner(self, detection_callback):
+        return SimulatedScanner(self, detection_callback)
+
+    async def find_device(self, address, timeout):
+        wristband = self.wristbands.get(address.upper())
+        return wristband.device if wristband else None
+
+    def client(self, device, disconnected_callback=None):
+        return SimulatedClient(self.wristbands[device.address.upper()], disconnected_callback)
+
+    def drop(self, address, seconds=0.0):
+        """Break the link to ``address`` and keep the wristband unreachable for ``seconds``.
+
+        Callable from any thread: the link is broken on the loop that made it,
+        where its disconnect callback schedules the reconnect.
+        """
+        wristband = self.wristbands[address.upper()]
+        wristband.reachable_at = time.monotonic() + seconds
+        if wristband.client is not None and wristband.client.is_connected:
+            wristband.client.loop.call_soon_threadsafe(wristband.client.drop)
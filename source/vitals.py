@@ -0,0 +1,206 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+# Samples per second of one PPG channel. With CHANNELS == 2 the stream is read as
+# interleaved (red, infrared) pairs, which is what the SpO2 estimate needs.
+SAMPLE_RATE = 200
+CHANNELS = 1
+
+HEART_BAND = (0.5, 4.0)
+FILTER_TAPS = 201
+MIN_BEAT_INTERVAL = 0.33
+BEATS_FOR_RATE = 8
+
+RESPIRATION_BAND = (0.1, 0.5)
+RESPIRATION_BLOCK = 0.25
+RESPIRATION_WINDOW = 32
+RESPIRATION_HOP = 1
+# Until a full window has arrived the rate is estimated from what there is,
+# once that covers a couple of breaths.
+RESPIRATION_MIN_WINDOW = 8
+
+SPO2_WINDOW = 4
+
+# Seconds of signal the estimates are drawn from. A reader further behind
+# than this, e.g. on a long recording just opened, starts afresh on the tail.
+VITALS_TAIL = 40
+
+
+def bandpass_taps(low, high, sample_rate, taps=FILTER_TAPS):
+    n = np.arange(taps) - (taps - 1) / 2
+    window = np.hamming(taps)
+
+    def lowpass(cutoff):
+        h = np.sinc(2 * cutoff / sample_rate * n) * window
+        return h / h.sum()
+
+    return lowpass(high) - lowpass(low)
+
+
+class FirFilter:
+    def __init__(self, taps):
+        self.taps = taps
+        self.state = None
+
+    def process(self, x):
+        if self.state is None:
+            self.state = np.full(len(self.taps) - 1, x[0] if len(x) else 0.0)
+        data = np.concatenate((self.state, x))
+        self.state = data[len(x):]
+        return np.convolve(data, self.taps, mode='valid')
+
+
+class BeatDetector:
+    def __init__(self, sample_rate, beats=BEATS_FOR_RATE):
+        self.sample_rate = sample_rate
+        self.min_distance = int(MIN_BEAT_INTERVAL * sample_rate)
+        self.tail = np.empty(0)
+        self.offset = 0
+        self.envelope = 0.0
+        self.last_peak = None
+        self.intervals = deque(maxlen=beats)
+
+    def process(self, y):
+        if len(y):
+            self.envelope = 0.8 * self.envelope + 0.2 * float(np.max(np.abs(y)))
+        data = np.concatenate((self.tail, y))
+        if len(data) < 3:
+            self.tail = data
+            return
+        middle = data[1:-1]
+        peaks = np.flatnonzero((middle > data[:-2]) & (middle >= data[2:]) & (middle > 0.4 * self.envelope)) + 1
+        for peak in peaks + self.offset:
+            if self.last_peak is None:
+                self.last_peak = peak
+            elif peak - self.last_peak >= self.min_distance:
+                self.intervals.append(peak - self.last_peak)
+                self.last_peak = peak
+        self.offset += len(data) - 2
+        self.tail = data[-2:]
+
+    @property
+    def heart_rate(self):
+        if len(self.intervals) < 2:
+            return None
+        return 60 * self.sample_rate / float(np.median(self.intervals))
+
+
+class RespirationEstimator:
+    """Respiration rate from the slow baseline modulation of the PPG.
+
+    The raw signal is averaged into ``RESPIRATION_BLOCK`` second blocks as it
+    arrives; every ``RESPIRATION_HOP`` seconds the spectrum of the last
+    ``RESPIRATION_WINDOW`` seconds of blocks is searched for the strongest
+    component in ``RESPIRATION_BAND``. Shorter windows, from
+    ``RESPIRATION_MIN_WINDOW`` seconds on, give a ``provisional`` rate.
+    """
+
+    def __init__(self, sample_rate):
+        self.block = int(RESPIRATION_BLOCK * sample_rate)
+        self.blocks = deque(maxlen=int(RESPIRATION_WINDOW / RESPIRATION_BLOCK))
+        self.hop = int(RESPIRATION_HOP / RESPIRATION_BLOCK)
+        self.min_blocks = int(RESPIRATION_MIN_WINDOW / RESPIRATION_BLOCK)
+        self.pending = np.empty(0)
+        self.new_blocks = 0
+        self.rate = None
+        self.provisional = False
+        freqs = np.fft.rfftfreq(self.blocks.maxlen, d=RESPIRATION_BLOCK)
+        self.band = (freqs >= RESPIRATION_BAND[0]) & (freqs <= RESPIRATION_BAND[1])
+        self.freqs = freqs[self.band]
+        self.window = np.hanning(self.blocks.maxlen)
+
+    def process(self, x):
+        data = np.concatenate((self.pending, x))
+        full = len(data) - len(data) % self.block
+        self.pending = data[full:]
+        if full == 0:
+            return
+        self.blocks.extend(data[:full].reshape(-1, self.block).mean(axis=1))
+        self.new_blocks += full // self.block
+        if len(self.blocks) >= self.min_blocks and self.new_blocks >= self.hop:
+            self.new_blocks = 0
+            series = np.fromiter(self.blocks, dtype=float, count=len(self.blocks))
+            self.provisional = len(series) < self.blocks.maxlen
+            # A partial window is zero-padded to the full length, so it is
+            # searched on the same frequency grid.
+            window = np.hanning(len(series)) if self.provisional else self.window
+            spectrum = np.abs(np.fft.rfft((series - series.mean()) * window, n=self.blocks.maxlen))[self.band]
+            self.rate = 60 * float(self.freqs[np.argmax(spectrum)])
+
+
+class Spo2Estimator:
+    def __init__(self, sample_rate):
+        self.window = int(SPO2_WINDOW * sample_rate)
+        self.pending = np.empty((0, 2))
+        self.spo2 = None
+
+    def process(self, frames):
+        data = np.concatenate((self.pending, frames))
+        full = len(data) - len(data) % self.window
+        self.pending = data[full:]
+        if full == 0:
+            return
+        last = data[full - self.window:full]
+        dc = last.mean(axis=0)
+        if np.all(dc > 0):
+            red, infrared = last.std(axis=0) / dc
+            if infrared > 0:
+                self.spo2 = float(np.clip(110 - 25 * red / infrared, 70, 100))
+
+
+class VitalSignEngine:
+    """Incremental vital-sign estimates for one capture.
+
+    ``update`` consumes only the samples written since the previous call, so
+    each sample is filtered and each analysis window evaluated exactly once
+    however often the dashboard polls. Only the last ``VITALS_TAIL`` seconds
+    are read when it is further behind than that.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.cursor = 0
+        self.reset()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        self.pending = np.empty(0)
+        self.filter = FirFilter(bandpass_taps(*HEART_BAND, self.sample_rate))
+        self.beats = BeatDetector(self.sample_rate)
+        self.respiration = RespirationEstimator(self.sample_rate)
+        self.oximetry = Spo2Estimator(self.sample_rate) if self.channels == 2 else None
+
+    def update(self, sample_buffer):
+        with self.lock:
+            tail = VITALS_TAIL * self.sample_rate * self.channels
+            if sample_buffer.count - self.cursor > tail:
+                self.reset()
+                self.cursor = (sample_buffer.count - tail) // self.channels * self.channels
+            samples, self.cursor = sample_buffer.read_since(self.cursor, tail)
+            self.process(samples)
+            return self.latest()
+
+    def process(self, samples):
+        signal = samples.astype(float)
+        if self.oximetry is not None:
+            data = np.concatenate((self.pending, signal))
+            full = len(data) - len(data) % 2
+            self.pending = data[full:]
+            frames = data[:full].reshape(-1, 2)
+            self.oximetry.process(frames)
+            signal = frames[:, 1]
+        if len(signal) == 0:
+            return
+        self.beats.process(self.filter.process(signal))
+        self.respiration.process(signal)
+
+    def latest(self):
+        return {
+            "heart_rate": self.beats.heart_rate,
+            "respiration_rate": self.respiration.rate,
+            "respiration_provisional": self.respiration.provisional,
+            "spo2": self.oximetry.spo2 if self.oximetry is not None else None
+        }